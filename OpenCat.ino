@@ -138,7 +138,8 @@ void otherModule() {  //this is an example that use the analog input pin A2 as a
     PTL(currentReading);
     if (currentReading < 100) {  //touch and hold on the A2 pin until the condition is met
       beep(10, 20, 50, 3);       //make sound within this function body
-      tQueue->createTask();      //more tokens are defined in OpenCat.h
+      char demo[] = "kvtF:2000>kup";  //an example task string, more tokens are defined in OpenCat.h
+      tQueue->createTask(demo);
     } else {
       strcpy(newCmd, "sit");          //load a skill to be processed by the later reaction function
       if (strcmp(lastCmd, newCmd)) {  //won't repeatively load the same skill
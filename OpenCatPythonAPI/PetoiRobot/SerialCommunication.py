@@ -31,6 +31,7 @@ class Communication(object):
         Ret = False
         self.data = None
         self.b_c_text = None
+        self.lastSkill = None  # digest of the last K skill the board took, see skillPacket() in ardSerial.py
 
         try:
             # open the serial port and get the serial port object
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 # -*- coding: UTF-8 -*-
 
+import hashlib
 import struct
 import sys
 import time
@@ -60,8 +61,29 @@ def encode(in_str, encoding='utf-8'):
         return in_str.encode(encoding)
 
 delayBetweenSlice = 0.001
+bootBanner = '* Start *'    # printed by the firmware when it starts
+replaySkill = b'T~'    # T_TEMP runs the last K skill the board received again
 
-def serialWriteNumToByte(port, token, var=None):  # Only to be used for c m u b I K L o within Python
+def outWaiting(port):
+    try:
+        return port.main_engine.out_waiting
+    except Exception:    # not supported by the driver
+        return 0
+
+
+# the bytes to write for the encoded K skill: T if the board already holds the same skill
+def skillPacket(port, in_str):
+    digest = hashlib.blake2b(in_str, digest_size=16).digest()
+    if digest == port.lastSkill:
+        logger.debug('%s already holds the skill, replaying it with T', port.port)
+        return replaySkill
+    port.lastSkill = digest
+    return in_str
+
+
+def serialWriteNumToByte(port, token, var=None, progress=None, abort=None):  # Only to be used for c m u b I K L o within Python
+    # progress(sent, total, bytesPerSecond) is called after every slice, the sending stops when the abort event is set
+    # returns [bytes sent, bytes of the command], fewer are sent when the abort event is set
     # print("Num Token "); print(token);print(" var ");print(var);print("\n\n");
     logger.debug(f'serialWriteNumToByte, token={token}, var={var}')
     in_str = ""
@@ -100,6 +122,7 @@ def serialWriteNumToByte(port, token, var=None):  # Only to be used for c m u b
             
         var = list(map(int, var))
         in_str = token.encode() + struct.pack('b' * len(var), *var) + '~'.encode()
+        in_str = skillPacket(port, in_str)
 
     else:
         if token.isupper():# == 'L' or token == 'I' or token == 'B' or token == 'C':
@@ -129,14 +152,24 @@ def serialWriteNumToByte(port, token, var=None):  # Only to be used for c m u b
             in_str = token.encode()+encode(message) +'\n'.encode()
 
     slice = 0
+    start = time.time()
     while len(in_str) > slice:
+        if abort is not None and abort.is_set():
+            break
         if len(in_str) - slice >= 20:
             port.Send_data(in_str[slice:slice+20])
         else:
             port.Send_data(in_str[slice:])
-        slice+=20
+        slice = min(slice + 20, len(in_str))
         time.sleep(delayBetweenSlice)
+        queued = outWaiting(port)
+        while queued >= 20:    # let the link take the previous slice first
+            time.sleep(queued / (port.main_engine.baudrate / 10.0))
+            queued = outWaiting(port)
+        if progress is not None:
+            progress(slice, len(in_str), (slice - queued) / max(time.time() - start, 1e-6))
     logger.debug(f"!!!! {in_str}")
+    return [slice, len(in_str)]
             #print(encode(in_str))
 #            port.Send_data(encode(message))
 
@@ -191,6 +224,8 @@ def printSerialMessage(port, token, timeout=0):
                 else:
                     # print(response, flush=True)
                     allPrints += response
+                    if bootBanner in response:
+                        port.lastSkill = None
         now = time.time()
         if (now - startTime) > threshold:
             # print('Elapsed time: ', end='')
@@ -213,7 +248,8 @@ def sendTask(PortList, port, task, timeout=0):  # task Structure is [token, var=
             previousBuffer = port.main_engine.read_all().decode('ISO-8859-1')
             if previousBuffer:
                 logger.debug(f"Previous buffer: {previousBuffer}")
-                pass
+                if bootBanner in previousBuffer:
+                    port.lastSkill = None
             if len(task) == 2:
                 #        print('a')
                 #        print(task[0])
@@ -229,6 +265,8 @@ def sendTask(PortList, port, task, timeout=0):  # task Structure is [token, var=
             if token == 'I' or token =='L':
                 timeout = 1 # in case the UI gets stuck
             lastMessage = printSerialMessage(port, token, timeout)
+            if token == 'K' and (lastMessage == -1 or 'OVF' in lastMessage[1]):
+                port.lastSkill = None
             time.sleep(task[-1])
         #    with lock:
         #        sync += 1
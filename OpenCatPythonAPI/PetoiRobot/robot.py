@@ -4,6 +4,7 @@
 # Python
 from .ardSerial import *
 from .SerialCommunication import *
+from .skillCache import SkillCache
 import struct
 import time
 import re
@@ -52,6 +53,7 @@ def makeDirectory(path):
         return False
 
 makeDirectory(configDir)
+cachedSkills = SkillCache(configDir)    # the parsed skill files, see loadSkill()
 
 def file_name(file_dir):
     # printH("file_dir:",file_dir)
@@ -282,7 +284,7 @@ def printSkillFileName():
         modelName = config.model_
     printH("modelName:", modelName)
     skillDir = configDir + seperation + 'SkillLibrary' + seperation + modelName
-    skill_file_name=file_name(skillDir)
+    skill_file_name = cachedSkills.skillNames(skillDir)
     print("*** The skill names you can call are as follows: ***")
     for skillName in skill_file_name:
         printH("* ",skillName)
@@ -362,7 +364,10 @@ def sendSkillStr(skillStr, delayTime):
 # perform a skill exported from the Skill Composer
 # the file directory is: "/$HOME/.config/Petoi/SkillLibrary/{model}/xxx.md" for Linux and macOS
 # the file directory is: "%HOMEDRIVE%\%HomePath%\.config\Petoi\SkillLibrary\{model}\xxx.md" for Windows
-def loadSkill(fileName, delayTime):
+# progress(sent, total, bytesPerSecond) is called while the skill is uploaded, setting the abort event stops it
+# a skill that the robot received last is replayed with the 1-byte token T instead of being sent again
+# the file is parsed only once, until it is modified, see skillCache.py
+def loadSkill(fileName, delayTime, progress=None, abort=None):
     global modelName
     # get the path of the exported skill file
     if ".md" in fileName:
@@ -372,31 +377,38 @@ def loadSkill(fileName, delayTime):
 
     logger.debug(f'skillFilePath:{skillFilePath}')
 
-    # open the skill file
-    with open(skillFilePath,"r",encoding='utf-8') as f:
-        line = f.readline()  # get the whole line content
-        while line:
-            #key words
-            if ("# Token") in line:
-                # get the token
-                line = next(f) #get the next line
-                token = line.replace("\n","")
-                logger.debug(f'token:{token}')
-            if ("# Data") in line:
-                # get the skill data
-                lines = f.readlines()  # get the rest lines of the file
-                logger.debug(f'lines:{lines}')
-            line = f.readline()
-    skillDataString = ''.join((str(x) for x in lines))
-    logger.debug(f'skillDataString:{skillDataString}')
-    skillDataString = ''.join(skillDataString.split()).split('{')[1].split('}')[0].split(',')
-    logger.debug(f'skillDataString:{skillDataString}')
-    if skillDataString[-1] == '':
-        skillDataString = skillDataString[:-1]
-    cmdList = list(map(int, skillDataString))
+    skill = cachedSkills.get(skillFilePath)
+    token = skill.token
+    cmdList = skill.cmdList()
+    logger.debug(f'token:{token}')
     logger.debug(f'cmdList:{cmdList}')
 
-    send(goodPorts, [token, cmdList, delayTime])
+    if progress is None and abort is None:
+        send(goodPorts, [token, cmdList, delayTime])
+    else:
+        uploadSkill(token, cmdList, delayTime, progress, abort)
+
+
+# send a long skill to every robot, see loadSkill()
+def uploadSkill(token, cmdList, delayTime, progress=None, abort=None):
+    result = -1
+    for port in list(goodPorts):
+        if bootBanner in port.main_engine.read_all().decode('ISO-8859-1'):    # the previous buffer
+            port.lastSkill = None
+        sent, total = serialWriteNumToByte(port, token, list(cmdList), progress, abort)
+        if sent < total:
+            logger.info('upload stopped after %d of %d bytes', sent, total)
+            port.lastSkill = None
+            if sent:
+                # the robot drops the unfinished skill after 0.2 s, prints ABT and stands up
+                printSerialMessage(port, token, 3)
+                printSerialMessage(port, 'k', 3)
+            return -1
+        result = printSerialMessage(port, token)
+        if result == -1 or 'OVF' in result[1]:
+            port.lastSkill = None
+    time.sleep(delayTime)
+    return result
 
 
 # send a command string
@@ -0,0 +1,167 @@
+#  -*- coding: UTF-8 -*-
+
+# Cache of the skill files exported by the Skill Composer, see loadSkill() in robot.py.
+# Each file is parsed once into its token, its data as an int8 array and a few details (model, creator,
+# frame count, period). The parsed skills are kept in memory in an LRU, keyed by the path, and are valid as long as
+# the file's mtime and size don't change. They are also saved in one index file, so the next run parses nothing:
+# only a stat of the file is left for a skill called again and again.
+
+import array
+import collections
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+indexName = 'skillCache.json'
+indexVersion = 1
+memorySize = 64    # skills kept parsed in memory
+
+
+def parseSkillFile(text):
+    # the format written by SkillComposer.export: "# Token", the token on the next line, "# Data", then {data};
+    token = None
+    details = {}
+    lines = text.split('\n')
+    for i, line in enumerate(lines):
+        if line.startswith('# Token') and i + 1 < len(lines):
+            token = lines[i + 1].strip()
+        elif line.startswith('# Data'):
+            data = ''.join(''.join(lines[i + 1:]).split()).split('{')[1].split('}')[0].split(',')
+            break
+        elif ':' in line and not line.startswith('#'):
+            key, value = line.split(':', 1)
+            if key.strip() in ('Model', 'Creator'):
+                details[key.strip().lower()] = value.strip()
+    else:
+        raise ValueError('no skill data')
+    if token is None:
+        raise ValueError('no skill token')
+    if data[-1] == '':
+        data = data[:-1]
+    values = list(map(int, data))
+    try:
+        data = array.array('b', values)
+    except OverflowError:    # angles written without the angle ratio are rescaled when sent, see serialWriteNumToByte()
+        data = array.array('h', values)
+    details['period'] = data[0] if token == 'K' and data else None
+    details['frames'] = abs(data[0]) if token == 'K' and data else None
+    return token, data, details
+
+
+class SkillEntry(object):
+    def __init__(self, stamp, token, data, details):
+        self.stamp = stamp    # [mtime in ns, size] of the file it was parsed from
+        self.token = token
+        self.data = data
+        self.model = details.get('model')
+        self.creator = details.get('creator')
+        self.period = details.get('period')
+        self.frames = details.get('frames')
+
+    def cmdList(self):
+        # a new list every time, the sending may rescale it
+        return self.data.tolist()
+
+    def toIndex(self):
+        return {'stamp': self.stamp, 'token': self.token, 'type': self.data.typecode, 'data': self.data.tobytes().hex(),
+                'model': self.model, 'creator': self.creator, 'period': self.period, 'frames': self.frames}
+
+    @staticmethod
+    def fromIndex(item):
+        data = array.array(item['type'])
+        data.frombytes(bytes.fromhex(item['data']))
+        return SkillEntry(item['stamp'], item['token'], data, item)
+
+
+class SkillCache(object):
+    """
+    Parsed skill files, in memory and in the index file of the config directory
+    """
+    def __init__(self, directory=None, size=memorySize):
+        self.indexPath = os.path.join(directory, indexName) if directory else None
+        self.size = size
+        self.entries = collections.OrderedDict()    # path: SkillEntry, the most recently used last
+        self.index = None    # path: serialized entry, loaded from the index file on the first miss
+        self.listings = {}    # skill directory: [mtime in ns, skill names]
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """
+        the SkillEntry of the skill file, raises OSError if the file can't be read
+        """
+        info = os.stat(path)
+        stamp = [info.st_mtime_ns, info.st_size]
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry.stamp == stamp:
+                self.entries.move_to_end(path)
+                return entry
+            item = self.loadIndex().get(path)
+        if item is not None and item.get('stamp') == stamp:
+            try:
+                entry = SkillEntry.fromIndex(item)
+            except (KeyError, TypeError, ValueError):
+                entry = None
+        else:
+            entry = None
+        if entry is None:
+            with open(path, 'r', encoding='utf-8') as f:
+                token, data, details = parseSkillFile(f.read())
+            entry = SkillEntry(stamp, token, data, details)
+            logger.debug('parsed %s: %s, %d values', path, token, len(data))
+            self.saveIndex(path, entry)
+        with self.lock:
+            self.entries[path] = entry
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        return entry
+
+    def skillNames(self, directory):
+        """
+        the names of the skill files in the directory, listed again when a file is added, removed or renamed
+        """
+        stamp = os.stat(directory).st_mtime_ns
+        listing = self.listings.get(directory)
+        if listing is None or listing[0] != stamp:
+            names = [name.split('.')[0] for name in os.listdir(directory) if os.path.splitext(name)[1] == '.md']
+            listing = self.listings[directory] = [stamp, names]
+        return list(listing[1])
+
+    def loadIndex(self):
+        if self.index is None:
+            self.index = {}
+            if self.indexPath is not None:
+                try:
+                    with open(self.indexPath, 'r', encoding='utf-8') as f:
+                        index = json.load(f)
+                    if index.get('version') == indexVersion:
+                        self.index = index.get('skills', {})
+                except (OSError, ValueError, AttributeError):
+                    pass    # no index yet, or a broken one that will be written again
+        return self.index
+
+    def saveIndex(self, path, entry):
+        with self.lock:
+            index = self.loadIndex()
+            index[path] = entry.toIndex()
+            for stale in [p for p in index if not os.path.exists(p)]:
+                del index[stale]
+            if self.indexPath is None:
+                return
+            temporary = self.indexPath + '.tmp' + str(os.getpid())
+            try:
+                with open(temporary, 'w', encoding='utf-8') as f:
+                    json.dump({'version': indexVersion, 'skills': index}, f)
+                os.replace(temporary, self.indexPath)    # the other programs read a complete index
+            except OSError as e:
+                logger.info('cannot save the skill index: %s', e)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.listings.clear()
+            self.index = None
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 # -*- coding: UTF-8 -*-
 from commonVar import *
+from commandChannel import keyedChannel
 
 language = languageList['English']
 
@@ -62,6 +63,7 @@ class Calibrator:
         language = lan
 #        global goodPorts
         connectPort(goodPorts)
+        self.calibUpdates = keyedChannel(goodPorts, 'c')  # a slider drag only sends the newest offset of each joint
         start = time.time()
         while config.model_ == '':
             if time.time() - start > 5:
@@ -96,8 +98,8 @@ class Calibrator:
         standButton = Button(self.frameCalibButtons, text=txt('Stand Up'), fg = 'blue', width=self.calibButtonW, command=lambda cmd='balance': self.calibFun(cmd))
         restButton = Button(self.frameCalibButtons, text=txt('Rest'),fg = 'blue', width=self.calibButtonW, command=lambda cmd='d': self.calibFun(cmd))
         walkButton = Button(self.frameCalibButtons, text=txt('Walk'),fg = 'blue', width=self.calibButtonW, command=lambda cmd='walk': self.calibFun(cmd))
-        saveButton = Button(self.frameCalibButtons, text=txt('Save'),fg = 'blue', width=self.calibButtonW, command=lambda: send(goodPorts, ['s', 0]))
-        abortButton = Button(self.frameCalibButtons, text=txt('Abort'),fg = 'blue', width=self.calibButtonW, command=lambda: send(goodPorts, ['a', 0]))
+        saveButton = Button(self.frameCalibButtons, text=txt('Save'),fg = 'blue', width=self.calibButtonW, command=lambda: self.sendAfterOffsets(['s', 0]))
+        abortButton = Button(self.frameCalibButtons, text=txt('Abort'),fg = 'blue', width=self.calibButtonW, command=lambda: self.sendAfterOffsets(['a', 0]))
 #        quitButton = Button(self.frameCalibButtons, text=txt('Quit'),fg = 'blue', width=self.calibButtonW, command=self.closeCalib)
         calibButton.grid(row=6, column=0)
         restButton.grid(row=6, column=1)
@@ -219,6 +221,7 @@ class Calibrator:
     def calibFun(self, cmd):
 #        global ports
         imageW = self.parameterSet['imageW']
+        self.calibUpdates.flush()
 
         self.imgPosture.destroy()
         if cmd == 'c' or cmd == 'c-2':
@@ -268,7 +271,11 @@ class Calibrator:
     def setCalib(self, idx, value):
         if self.calibratorReady:
             value = int(value)
-            send(goodPorts, ['c', [idx, value], 0])
+            self.calibUpdates.put(idx, value)
+
+    def sendAfterOffsets(self, task):
+        self.calibUpdates.flush()
+        send(goodPorts, task)
 
     def closeCalib(self):
         confirm = messagebox.askyesnocancel(title=None, message=txt('Do you want to save the offsets?'),
@@ -276,9 +283,9 @@ class Calibrator:
         if confirm is not None:
 #            global ports
             if confirm:
-                send(goodPorts, ['s', 0])
+                self.sendAfterOffsets(['s', 0])
             else:
-                send(goodPorts, ['a', 0])
+                self.sendAfterOffsets(['a', 0])
             time.sleep(0.1)
             self.calibratorReady = False
             self.calibSliders.clear()
@@ -13,6 +13,8 @@ import threading
 from tkinter.filedialog import asksaveasfile, askopenfilename
 from tkinter.colorchooser import askcolor
 from commonVar import *
+from jointState import jointUpdateTasks, jointPairsTasks
+from commandChannel import LatestChannel
 import re
 from tkinter import ttk
 language = languageList['English']
@@ -205,6 +207,7 @@ class SkillComposer:
         self.binderButton = list()
         self.previousBinderValue = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0]
         self.keepChecking = True
+        self.jointUpdates = LatestChannel(self.sendJoints)  # slider drags only send the newest angle of each joint
         self.ready = 0
         self.creatorInfoAcquired = False
         self.creator = StringVar()
@@ -939,19 +942,15 @@ class SkillComposer:
 
     def transformToFrame(self, f):
         frame = self.frameList[f]
+        self.jointUpdates.flush()
 
-        indexedList = list()
-        for i in range(16):
-            if self.frameData[4 + i] != frame[2][4 + i]:
-                indexedList += [i, frame[2][4 + i]]
+        previous = self.frameData[4:20]
         self.frameData = copy.deepcopy(frame[2])
         self.updateSliders(self.frameData)
         self.changeButtonState(f)
 
-        if len(indexedList) > 10:
-            send(ports, ['L', self.frameData[4:20], 0.05])
-        elif len(indexedList):
-            send(ports, ['I', indexedList, 0.05])
+        for task in jointUpdateTasks(previous, self.frameData[4:20], 0.05):
+            send(ports, task)
 
     def setFrame(self, currentRow):
         frame = self.frameList[currentRow]
@@ -1392,6 +1391,7 @@ class SkillComposer:
         self.updateSliders(self.frameData)
         self.indicateEdit()
         self.frameController.update()
+        self.jointUpdates.flush()    # a pending slider value must not arrive after the mirrored frame
         send(ports, ['L', self.frameData[4:20], 0.05])
         
     def popCreator(self):
@@ -1571,6 +1571,7 @@ class SkillComposer:
         print(skillData)
         if period == 1:
             print(self.frameData[4:20])
+            self.jointUpdates.flush()
             send(ports, ['L', self.frameData[4:20], 0.05])
             return
         if angleRatio == 2:
@@ -1644,9 +1645,17 @@ class SkillComposer:
         flat_list = [item for sublist in skillData for item in sublist]
         print(flat_list)
 
+        self.jointUpdates.flush()
         send(ports, ['i', 0.1])
-        res = send(ports, ['K', flat_list, 0], 0)
-        print(res)
+        for p in list(ports):
+            res = uploadTask(ports, p, ['K', flat_list, 0], self.showUpload)
+            print(res)
+        self.window.title(txt('skillComposerTitle'))
+
+    def showUpload(self, sent, total, bytesPerSecond):
+        # only redraw, a click handled now could write between the chunks
+        self.window.title('{}  {}%  {:.0f} B/s'.format(txt('skillComposerTitle'), sent * 100 // total, bytesPerSecond))
+        self.window.update_idletasks()
 
     def restartSkillEditor(self):
         for f in self.frameList:
@@ -1712,22 +1721,13 @@ class SkillComposer:
             value = int(value)
             if self.binderValue[idx].get() == 0:
                 self.frameData[4 + idx] = value
-                if -126 < value < 126:
-                    send(ports, ['I', [idx, value], 0.05])
-                else:
-                    send(ports, ['i', [idx, value], 0.05])
+                self.jointUpdates.put(idx, value)
             else:
                 diff = value - self.frameData[4 + idx]
-                indexedList = list()
                 for i in range(16):
                     if self.binderValue[i].get():
                         self.frameData[4 + i] += diff * self.binderValue[i].get() * self.binderValue[idx].get()
-                        indexedList += [i, self.frameData[4 + i]]
-                        
-                if len(indexedList) > 10:
-                    send(ports, ['L', self.frameData[4:20], 0.05])
-                elif len(indexedList):
-                    send(ports, ['I', indexedList, 0.05])
+                        self.jointUpdates.put(i, self.frameData[4 + i])
 
             self.indicateEdit()
             self.updateSliders(self.frameData)
@@ -1813,16 +1813,23 @@ class SkillComposer:
                 if j in negativeGroup:
                     self.frameData[4 + j] = self.originalAngle[4 + j] - int(value * factor)
 
-            send(ports, ['L', self.frameData[4:20], 0.05])
+            for j in range(16):
+                self.jointUpdates.put(j, self.frameData[4 + j])
             self.updateSliders(self.frameData)
             self.indicateEdit()
 
+    def sendJoints(self, batch):
+        # called by the channel's thread with the newest pending angles {joint index: angle}
+        for task in jointPairsTasks([n for pair in batch.items() for n in pair]):
+            send(ports, task)
+
 
     def sendCmd(self,event=None):
         if self.ready == 1:
             serialCmd = self.newCmd.get()
             logger.debug(f'serialCmd={serialCmd}')
             if serialCmd != '':
+                self.jointUpdates.flush()
                 try:
                     token = serialCmd[0]
                     if token == 'S': #send everything as a string
@@ -1850,6 +1857,7 @@ class SkillComposer:
             self.indicateEdit()
             for i in range(6):
                 self.values[16 + i].set(0)
+            self.jointUpdates.flush()    # the posture must come after the pending slider values
             send(ports,['i',0])
             send(ports, ['k' + pose, 0])
 #            if pose == 'rest':
@@ -1,6 +1,7 @@
 #!/opt/anaconda3/envs/petoi/bin/python3
 # -*- coding: UTF-8 -*-
 from commonVar import *
+from commandChannel import keyedChannel
 
 language = languageList['English']
 parName = ['lensFactor','proportion','speed','pan','tilt','frontUpX','backUpX','frontDownX','backDownX','frontUpY','backUpY','frontDownY','backDownY','frontUp','backUp','frontDown','backDown']
@@ -15,6 +16,7 @@ class Tuner:
         # global ports
         connectPort(goodPorts)
         # ports = goodPorts
+        self.tunerUpdates = keyedChannel(goodPorts, '}', self.setResult)  # a slider drag only sends the newest value of each parameter
         self.model = config.model_
         logger.info(f"The model is: {self.model}")
         global language
@@ -92,6 +94,7 @@ class Tuner:
 
 
     def showPara(self):
+        self.tunerUpdates.flush()
         paraList = self.result[-1].split('\r\n')
         logger.debug(f"The para list is: {paraList}")
         resultStr = paraList[-2].replace('\t', ', ')[:-2]
@@ -104,8 +107,11 @@ class Tuner:
     def setTuner(self, idx, value):
         if self.calibratorReady:
             value = int(value)
-            self.result = send(goodPorts, ['}', [idx, value], 0])
-            logger.debug(f"The result list is: {self.result}")
+            self.tunerUpdates.put(idx, value)
+
+    def setResult(self, result):
+        self.result = result
+        logger.debug(f"The result list is: {self.result}")
 
     def closeTuner(self):
         confirm = messagebox.askyesnocancel(title=None, message='Quit?',
@@ -16,8 +16,11 @@ else:
 sys.path.append(resourcePath)
 
 from ardSerial import *
+import tkinter as tk
+import tkinter.messagebox
 from tkinter import *
 from tkinter import messagebox
+startLogging()
 from PIL import ImageTk, Image
 import tkinter.font as tkFont
 import threading
@@ -4,8 +4,14 @@
 # modified from https://blog.csdn.net/u013541325/article/details/113062191
 
 import binascii
+import collections
+import threading
+import time
 import serial  # need to install pyserial first
 import serial.tools.list_ports
+from serialTrace import tracer
+from serialMetrics import metrics
+from serialSession import recorder
 
 # global variables
 # whether the serial port is created successfully or not
@@ -14,6 +20,332 @@ Ret = False
 port_list_number = []
 # list of serial port names
 port_list_name = []
+# number of unsolicited lines kept by each reader
+unsolicitedBufferSize = 256
+# printed by the firmware when it starts, see setup() in src/OpenCat.h
+bootBanner = b'* Start *'
+
+
+def lineToken(line, length):
+    """
+    the lower case bytes before the '\r' of a received line, only its first length + 1 bytes are looked at
+    """
+    return bytes(line[:length + 1]).split(b'\r', 1)[0].lower()
+
+
+patterns = {}  # accepted responses: their bytes, the longest length, the starts of their echo lines
+
+
+def echoPatterns(accepted):
+    found = patterns.get(accepted)
+    if found is None:
+        acceptedBytes = tuple(a.encode('ISO-8859-1') for a in accepted)
+        length = max(map(len, acceptedBytes)) if accepted else 0
+        echoes = None
+        if length == 1:  # single letters, an echo line can be searched for directly
+            echoes = tuple(set(e for a in acceptedBytes for e in (a + b'\r', a.upper() + b'\r')))
+        found = patterns[accepted] = (acceptedBytes, length, echoes)
+    return found
+
+
+class ResponseWaiter(object):
+    """
+    A request waiting for the echo of its token.
+    The lines received before the echo are collected as the request's prints.
+    The bytes are kept as received and only decoded by result() and lines().
+    """
+    def __init__(self, accepted):
+        self.accepted = accepted  # tuple of lower case responses that complete the request
+        self.acceptedBytes, self.length, self.echoes = echoPatterns(accepted)
+        self.created = time.perf_counter()
+        self.completed = None
+        self.prints = bytearray()
+        self.response = None
+        self.event = threading.Event()
+
+    def offer(self, line):
+        """
+        take a received line of bytes, return True if it completes the request
+        """
+        if lineToken(line, self.length) in self.acceptedBytes:
+            self.response = bytes(line)
+            self.completed = time.perf_counter()
+            self.event.set()
+            return True
+        self.prints += line
+        return False
+
+    def findEcho(self, buffer, start):
+        """
+        index of the first echo line in buffer after the line start, or -1
+        """
+        if buffer.startswith(self.echoes, start):
+            return start
+        found = -1
+        for echo in self.echoes:
+            index = buffer.find(echo, start)
+            while index > start and buffer[index - 1] != 10:  # not at the start of a line
+                index = buffer.find(echo, index + 1)
+            if index > start and (found < 0 or index < found):
+                found = index
+        return found
+
+    def fail(self):
+        self.event.set()
+
+    def result(self, timeout=None):
+        """
+        wait for the echo, return [response, allPrints] or -1 on timeout
+        """
+        if self.event.wait(timeout) and self.response is not None:
+            return [self.response.decode('ISO-8859-1'), self.prints.decode('ISO-8859-1')]
+        return -1
+
+    def lines(self):
+        """
+        the prints as a list of lines
+        """
+        return [line + '\n' for line in self.prints.decode('ISO-8859-1').split('\n')[:-1]]
+
+
+class SerialReader(threading.Thread):
+    """
+    Long-lived reader of a serial port.
+    It splits the incoming bytes into lines in place and hands them to the oldest waiting request.
+    The listeners and requests get each line as a memoryview of the receive buffer, a request copies
+    only its echo; the lines nobody asked for are copied into a bounded ring buffer.
+    """
+    def __init__(self, engine, bufferSize=unsolicitedBufferSize):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.engine = engine
+        self.lock = threading.Lock()
+        self.waiters = collections.deque()
+        self.unsolicited = collections.deque(maxlen=bufferSize)  # bytes, decoded by popUnsolicited()
+        self.listeners = []  # functions that may take a line before the requests, e.g. a data stream
+        self.subscribers = []  # functions that are given the lines no request took
+        self.pending = bytearray()
+        self.running = True
+        self.rebooted = False  # set when the boot banner arrives, cleared by whoever acts on it
+        self.metrics = metrics.port(engine.port)
+
+    def run(self):
+        while self.running:
+            try:
+                # blocks until data arrives or the port's read timeout expires
+                data = self.engine.read(self.engine.in_waiting or 1)
+            except Exception:
+                break
+            if data:
+                if recorder.active:
+                    recorder.read(self.engine.port, data)
+                self.feed(data)
+        self.running = False
+        with self.lock:
+            while self.waiters:
+                self.waiters.popleft().fail()
+
+    def feed(self, data):
+        self.metrics.bytesIn += len(data)
+        with self.lock:
+            pending = self.pending
+            pending += data
+            if pending.find(bootBanner, max(0, len(pending) - len(data) - len(bootBanner) + 1)) >= 0:
+                self.rebooted = True
+            if b'\n' not in data:  # no new line is complete
+                return
+            start = 0
+            view = memoryview(pending)
+            while True:
+                if self.waiters and self.waiters[0].echoes and not self.listeners:
+                    # the prints of a request are not split into lines, its echo is searched for in place
+                    waiter = self.waiters[0]
+                    echo = waiter.findEcho(pending, start)
+                    if echo < 0:
+                        last = pending.rfind(b'\n', start) + 1
+                        if last > start:
+                            waiter.prints += view[start:last]
+                            start = last
+                        break
+                    waiter.prints += view[start:echo]
+                    start = echo
+                end = pending.find(b'\n', start)
+                if end < 0:
+                    break
+                self.dispatch(view[start:end + 1])
+                start = end + 1
+            view.release()
+            try:
+                del pending[:start]
+            except BufferError:  # a listener kept a line
+                self.pending = pending[start:]
+
+    def dispatch(self, line):
+        for listener in self.listeners:
+            if listener(line):
+                return
+        if self.waiters:
+            waiter = self.waiters[0]
+            if waiter.offer(line):
+                self.waiters.popleft()
+                self.metrics.latency.observe(waiter.completed - waiter.created)
+                if tracer.enabled:
+                    tracer.receive(self.engine.port, waiter.response[:1], len(waiter.response) + len(waiter.prints),
+                                   waiter.completed - waiter.created)
+        else:
+            line = bytes(line)
+            if self.subscribers:
+                text = line.decode('ISO-8859-1')
+                for subscriber in self.subscribers:
+                    subscriber(text)
+            self.unsolicited.append(line)
+
+    def expect(self, accepted):
+        """
+        register a request before its command is written to the port
+        """
+        waiter = ResponseWaiter(accepted)
+        with self.lock:
+            if self.running:
+                self.waiters.append(waiter)
+            else:
+                waiter.fail()
+        return waiter
+
+    def addListener(self, listener):
+        """
+        listener(line) is called in the reader thread and returns True if it consumed the line.
+        line is a memoryview of the receive buffer, only valid during the call
+        """
+        with self.lock:
+            self.listeners = self.listeners + [listener]
+
+    def removeListener(self, listener):
+        with self.lock:
+            self.listeners = [l for l in self.listeners if l is not listener]
+
+    def addSubscriber(self, subscriber):
+        """
+        subscriber(line) is called in the reader thread with every unsolicited line
+        """
+        with self.lock:
+            self.subscribers = self.subscribers + [subscriber]
+
+    def removeSubscriber(self, subscriber):
+        with self.lock:
+            self.subscribers = [s for s in self.subscribers if s is not subscriber]
+
+    def cancel(self, waiter):
+        with self.lock:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+                # the lines it collected were not consumed by anyone
+                self.unsolicited.extend(line + b'\n' for line in bytes(waiter.prints).split(b'\n')[:-1])
+
+    def flush(self):
+        """
+        move the unfinished line into the unsolicited buffer and return it.
+        It is kept while a request waits, it may be the start of its echo.
+        """
+        with self.lock:
+            if not self.pending or self.waiters:
+                return ''
+            line = bytes(self.pending)
+            self.pending.clear()
+            self.unsolicited.append(line)
+        return line.decode('ISO-8859-1')
+
+    def popUnsolicited(self):
+        """
+        return and clear the unsolicited lines
+        """
+        with self.lock:
+            lines = list(self.unsolicited)
+            self.unsolicited.clear()
+        return [line.decode('ISO-8859-1') for line in lines]
+
+    def stop(self):
+        self.running = False
+
+
+# how a board's serial receive buffer takes a long packet
+# bufferSize: BUFF_LEN of the firmware, the longest binary command it can store
+writeProfiles = {
+    'NyBoard': {'chunkSize': 20, 'wholePackets': False, 'bufferSize': 467},    # ATmega328P, 64 byte receive buffer
+    'BiBoard': {'chunkSize': 256, 'wholePackets': True, 'bufferSize': 2507},    # ESP32, the buffer can take a whole packet
+}
+
+
+class PacedWriter(object):
+    """
+    Writes a long packet in chunks no faster than the link drains them.
+    The pace starts at the wire speed of the baud rate and follows the drain rate measured with out_waiting,
+    so slow links (e.g. Bluetooth SPP) are not overrun and fast ones are not slowed down by fixed sleeps.
+    """
+    def __init__(self, engine, write, board=None):
+        self.engine = engine
+        self.write = write
+        self.chunkSize = 20
+        self.wholePackets = False
+        self.bufferSize = None  # unknown until the board is set
+        self.wireRate = engine.baudrate / 10.0  # bytes per second, 10 bits per byte on the wire
+        self.drainRate = self.wireRate
+        if board is not None:
+            self.setBoard(board)
+
+    def setBoard(self, board):
+        profile = writeProfiles.get(board)
+        if profile is not None:
+            self.chunkSize = profile['chunkSize']
+            self.wholePackets = profile['wholePackets']
+            self.bufferSize = profile['bufferSize']
+
+    def outWaiting(self):
+        try:
+            return self.engine.out_waiting
+        except Exception:  # not supported by the driver
+            return None
+
+    def send(self, data, progress=None, abort=None):
+        """
+        progress(sent, total, bytesPerSecond) is called after every chunk.
+        The sending stops between two chunks when the abort event is set. Returns the number of bytes sent.
+        """
+        if len(data) <= self.chunkSize or self.wholePackets and progress is None and abort is None:
+            self.write(data)
+            if progress is not None:
+                progress(len(data), len(data), self.drainRate)
+            return len(data)
+        start = time.perf_counter()
+        sent = 0
+        lastTime = start
+        lastQueue = 0
+        for slice in range(0, len(data), self.chunkSize):
+            if sent:
+                wait = start + sent / self.drainRate - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+                queue = self.outWaiting()
+                if queue:  # the link is saturated, so the drained bytes measure its speed
+                    now = time.perf_counter()
+                    drained = lastQueue + self.chunkSize - queue
+                    if drained > 0 and now > lastTime:
+                        rate = min(self.wireRate, drained / (now - lastTime))
+                        self.drainRate = 0.8 * self.drainRate + 0.2 * rate
+                    lastTime, lastQueue = now, queue
+                    if queue >= self.chunkSize:  # let the queued chunk go out before adding another one
+                        time.sleep(queue / self.drainRate)
+                else:
+                    lastTime, lastQueue = time.perf_counter(), 0
+            if abort is not None and abort.is_set():
+                break
+            self.write(data[slice:slice + self.chunkSize])
+            sent += len(data[slice:slice + self.chunkSize])
+            if progress is not None:  # the bytes still queued on the host have not gone out yet
+                rate = (sent - (self.outWaiting() or 0)) / max(time.perf_counter() - start, 1e-6)
+                progress(sent, len(data), min(rate, self.wireRate))
+        return sent
+
 
 class Communication(object):
     """
@@ -29,13 +361,20 @@ class Communication(object):
         Ret = False
         self.data = None
         self.b_c_text = None
+        self.reader = None  # started on demand by Start_Reader()
+        self.writer = None  # paces the long packets, see Send_Packet()
+        self.requestLock = threading.RLock()  # keeps the order of the registered requests and the written commands
+        self.lastSkill = None  # digest of the last K skill the board took, see skillPacket() in ardSerial.py
+        self.metrics = metrics.port(com)
 
         try:
             # open the serial port and get the serial port object
             self.main_engine = serial.Serial(self.port, self.bps, timeout=self.timeout)
+            self.writer = PacedWriter(self.main_engine, self.main_engine.write)
             # determine whether the opening is successful
             if self.main_engine.is_open:
                 Ret = True
+                self.metrics.attach(self)
                 # print("Ret = ", Ret)
         except Exception as e:
             print("---Exception---：", e)
@@ -75,6 +414,8 @@ class Communication(object):
         close serial port
         """
         global Ret
+        if self.reader is not None:
+            self.reader.stop()
         # print(self.main_engine.is_open)  # check if the serial port is open
         # determine whether to open
         if self.main_engine.is_open:
@@ -111,7 +452,10 @@ class Communication(object):
         :param size:
         :return:
         """
-        return self.main_engine.read(size=size)
+        data = self.main_engine.read(size=size)
+        if recorder.active:
+            recorder.read(self.port, data)
+        return data
 
     # Receive a line of data
     # When using readline(), you should pay attention:
@@ -124,7 +468,22 @@ class Communication(object):
         Receive a line of data
         :return:
         """
-        return self.main_engine.readline()
+        data = self.main_engine.readline()
+        if recorder.active:
+            recorder.read(self.port, data)
+        return data
+
+
+    def Start_Reader(self):
+        """
+        start the background reader of the port if it is not running
+        """
+        with self.requestLock:  # two readers of one port would split its bytes between them
+            if self.reader is None or not self.reader.is_alive():
+                self.lastSkill = None  # the board may have been restarted while nobody was reading
+                self.reader = SerialReader(self.main_engine)
+                self.reader.start()
+            return self.reader
 
 
     def Send_data(self, data):
@@ -132,8 +491,29 @@ class Communication(object):
         send data
         :param data:
         """
+        tracer.send(self.port, data)
+        self.metrics.sent(data)
+        if recorder.active:
+            recorder.write(self.port, data)
         self.main_engine.write(data)
 
+    def Send_Packet(self, data, progress=None, abort=None):
+        """
+        send a long packet in chunks that the board can take, see PacedWriter.send()
+        """
+        tracer.send(self.port, data)
+        self.metrics.sent(data)
+        if recorder.active:
+            recorder.write(self.port, data)
+        return self.writer.send(data, progress, abort)
+
+
+    def Set_Board(self, board):
+        """
+        choose the write profile of the board, 'NyBoard' or 'BiBoard'
+        """
+        self.writer.setBoard(board)
+
     # more examples
     # self.main_engine.write(bytes(listData))  # send list data listData = [0x01, 0x02, 0xFD] or listData = [1, 2, 253]
     # self.main_engine.write(chr(0x06).encode("utf-8"))  # send a data in hexadecimal
@@ -0,0 +1,160 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Response deadlines learned from the measured latencies instead of fixed thresholds.
+# The latencies are kept per port and token, and per skill name for 'k', as the time beyond the expected duration
+# of the command, so a slow board or a Bluetooth link doesn't change the deadlines of the other robots. The expected duration of a K skill is estimated from its frames, like transform() and
+# perform() in src/motion.h and src/skill.h spend it. The deadline of a request is then
+#   expected * expectedMargin + p99 * safetyFactor, at least floorSeconds
+# so a dead link fails within a few hundred ms for the quick commands, while long skills get their time.
+# A request that times out counts as a latency of its deadline and doubles the next deadlines of its key
+# until a response arrives, so a deadline learned too tight loosens again.
+# Until a key has minSamples latencies, ardSerial.responseTimeout() keeps its fixed thresholds.
+
+import collections
+import threading
+
+safetyFactor = 3
+expectedMargin = 1.5    # the step time of the servos differs between the boards
+minSamples = 8
+floorSeconds = 0.3
+historySize = 128    # latencies kept per key
+maxBackoff = 16    # the deadline is multiplied by at most this after consecutive timeouts
+stepTime = 0.002    # seconds per step of transform()
+frameDelayUnit = 0.05    # the delay of a behavior frame is in 50 ms
+DOF = 16
+
+
+class LatencyStats(object):
+    """
+    The latest latencies of a key
+    """
+    def __init__(self, size=historySize):
+        self.samples = collections.deque(maxlen=size)
+        self.ordered = None    # sorted copy, rebuilt when a percentile is asked after new samples
+
+    def __len__(self):
+        return len(self.samples)
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.ordered = None
+
+    def percentile(self, p):
+        if self.ordered is None:
+            self.ordered = sorted(self.samples)
+        ordered = self.ordered
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+class TimeoutModel(object):
+    """
+    Latency distributions per key and the deadlines derived from them
+    """
+    def __init__(self, safety=safetyFactor, samples=minSamples, floor=floorSeconds):
+        self.safety = safety
+        self.minSamples = samples
+        self.floor = floor
+        self.stats = {}
+        self.backoff = {}    # key: factor of the deadline after timeouts
+        self.lock = threading.Lock()
+
+    def record(self, key, latency, expected=0):
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None:
+                stats = self.stats[key] = LatencyStats()
+            stats.add(max(0, latency - expected))
+            self.backoff.pop(key, None)
+
+    def expired(self, key, waited, expected=0):
+        """
+        a request got no response within waited seconds
+        """
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None or len(stats) < self.minSamples:
+                return    # the fixed thresholds are still used
+            stats.add(max(0, waited - expected))
+            self.backoff[key] = min(self.backoff.get(key, 1) * 2, maxBackoff)
+
+    def deadline(self, key, expected=0):
+        """
+        seconds to wait for the response, None if the key doesn't have enough samples yet
+        """
+        with self.lock:
+            stats = self.stats.get(key)
+            if stats is None or len(stats) < self.minSamples:
+                return None
+            p99 = stats.percentile(99)
+            backoff = self.backoff.get(key, 1)
+        return max(self.floor, expected * expectedMargin + p99 * self.safety) * backoff
+
+    def summary(self):
+        # {(port, key): [samples, p50, p99]} in seconds
+        with self.lock:
+            return {key: [len(s), s.percentile(50), s.percentile(99)] for key, s in self.stats.items() if len(s)}
+
+    def reset(self, key=None):
+        with self.lock:
+            if key is None:
+                self.stats.clear()
+                self.backoff.clear()
+            else:
+                self.stats.pop(key, None)
+                self.backoff.pop(key, None)
+
+
+def transformSeconds(current, target, speedRatio):
+    if speedRatio <= 0:
+        return stepTime
+    maxDiff = max(abs(c - t) for c, t in zip(current, target))
+    return (int(round(maxDiff / speedRatio)) + 1) * stepTime
+
+
+def skillDuration(data):
+    """
+    expected seconds from the start of a K skill to its echo
+    """
+    try:
+        period = int(data[0])
+        angleRatio = data[3] if data[3] > 0 else 1
+        if period > 0:    # postures and gaits echo after the transform to their first frame
+            frameSize = 16 if period == 1 else 8
+            first = [a * angleRatio for a in data[4:4 + frameSize]]
+            return transformSeconds([0] * frameSize, first, 1)
+        loopStart, loopEnd, loops = int(data[4]), int(data[5]), int(data[6])
+        frames = [data[7 + f * 20:7 + f * 20 + 20] for f in range(-period)]
+    except (IndexError, TypeError, ValueError):
+        return 0
+    seconds = 0
+    current = [0] * DOF
+    repeat = 0 if 0 <= loops < 2 else loops - 1
+    c = 0
+    while c < len(frames) and seconds < 600:    # an infinite loop is only broken by new serial input
+        frame = frames[c]
+        target = [a * angleRatio for a in frame[:DOF]]
+        seconds += transformSeconds(current, target, frame[DOF] / 4.0) + abs(frame[DOF + 1]) * frameDelayUnit
+        current = target
+        if repeat != 0 and c != 0 and c == loopEnd:
+            c = loopStart - 1
+            if repeat > 0:
+                repeat -= 1
+        c += 1
+    return seconds
+
+
+def taskKey(task):
+    # the skills sent by name are learned one by one, the model key is (port name, taskKey)
+    if len(task) == 2 and task[0][0] == 'k' and len(task[0]) > 1:
+        return task[0]
+    return task[0][0]
+
+
+def expectedDuration(task):
+    if task[0] == 'K' and len(task) > 2:
+        return skillDuration(task[1])
+    return 0
+
+
+timeouts = TimeoutModel()
@@ -1,6 +1,7 @@
 #!/usr/bin/python3
 # -*- coding: UTF-8 -*-
 
+import hashlib
 import struct
 import sys
 import time
@@ -12,6 +13,15 @@ import threading
 import os
 import config
 import glob
+import collections
+import queue
+from packetEncoder import getEncoder, encodeBinary
+import portCache
+import brokerClient
+import hotplug
+from serialTrace import startFileLogging, tracer
+from adaptiveTimeout import timeouts, taskKey, expectedDuration
+from serialMetrics import metrics, getStats, startMetricsServer
 
 FORMAT = '%(asctime)-15s %(name)s - %(levelname)s - %(message)s'
 '''
@@ -26,33 +36,44 @@ The default starting point is INFO,
 which means that the logging module will automatically filter out any DEBUG messages.
 '''
 # logging.basicConfig(level=logging.DEBUG, format=FORMAT)
-logging.basicConfig(filename='./logfile.log', filemode='a+', level=logging.INFO, format=FORMAT)
+# importing the module has no side effects, the applications start the log file with startLogging()
 logger = logging.getLogger(__name__)
 
 
+def startLogging(path='./logfile.log', level=logging.INFO):
+    # a new log file for every run, written by a background thread
+    startFileLogging(path, level, FORMAT, 'w+')
+
+
 def printH(head, value):
     print(head, end=' ')
     print(value)
 
 
-if not config.useMindPlus:
-    import tkinter as tk
-    import tkinter.messagebox
-    sys.path.append("../pyUI")
-    from translate import *
-    language = languageList['English']
+tk = None    # tkinter, imported by the functions that show a window, see loadGui()
+language = None
+
+
+def loadGui():
+    global tk
+    if tk is None:
+        import tkinter
+        import tkinter.messagebox
+        tk = tkinter
+    return tk
 
-    def txt(key):
-        global language
-        logger.debug(f"config.strLan is: {config.strLan}.")
-        language = languageList[config.strLan]
-        return language.get(key, textEN[key])
 
-    # printH("txt('lan'):", txt('lan'))
+def txt(key):
+    # the translation tables of the UI are only loaded on the first use
+    global language
+    pyUIPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'pyUI')
+    if pyUIPath not in sys.path:
+        sys.path.append(pyUIPath)
+    import translate
+    logger.debug("config.strLan is: %s.", config.strLan)
+    language = translate.languageList[config.strLan]
+    return language.get(key, translate.textEN[key])
 
-with open("./logfile.log", "w+", encoding="ISO-8859-1") as logfile:
-    pass
-time.sleep(1)
 logger.info("ardSerial date: Jun. 20, 2024")
 
 def encode(in_str, encoding='utf-8'):
@@ -63,88 +84,68 @@ def encode(in_str, encoding='utf-8'):
 
 delayBetweenSlice = 0.001
 
-def serialWriteNumToByte(port, token, var=None):  # Only to be used for c m u b I K L o within Python
+def encodeNumToByte(token, var=None):  # Only to be used for c m u b I K L o within Python
     # print("Num Token "); print(token);print(" var ");print(var);print("\n\n");
-    logger.debug(f'serialWriteNumToByte, token={token}, var={var}')
     in_str = ""
     if var is None:
         var = []
-    if token == 'K':
-        period = var[0]
-        #        print(encode(in_str))
-        if period > 0:
-            skillHeader = 4
-        else:
-            skillHeader = 7
-            
-        if period > 1:
-            frameSize = 8  # gait
-        elif period == 1:
-            frameSize = 16  # posture
-        else:
-            frameSize = 20  # behavior
-    # divide large angles by 2
-        angleRatio = 1
-        for row in range(abs(period)):
-            for angle in var[skillHeader + row * frameSize:skillHeader + row * frameSize + min(16,frameSize)]:
-                if angle > 125 or angle < -125:
-                    angleRatio = 2
-                    break
-            if angleRatio ==2:
-                break
-        
-        if angleRatio == 2:
-            var[3] = 2
-            for row in range(abs(period)):
-                for i in range(skillHeader + row * frameSize,skillHeader + row * frameSize + min(16,frameSize)):
-                    var[i] //=2
-            printH('rescaled:\n',var)
-            
-        var = list(map(int, var))
-        in_str = token.encode() + struct.pack('b' * len(var), *var) + '~'.encode()
+    if token.isupper():    # K L I B C W ... see packetEncoder.py
+        in_str = encodeBinary(token, var)
+
+    else:#if token == 'c' or token == 'm' or token == 'i' or token == 'b' or token == 'u' or token == 't':
+        message = ""
+        for element in var:
+            message +=  (str(round(element))+" ")
+        in_str = token.encode()+encode(message) +'\n'.encode()
+    return in_str
+
+
+def serialWriteSlices(port, in_str):
+    port.Send_Packet(in_str)
+
+
+replaySkill = b'T~'    # T_TEMP in src/reaction.h runs the last K skill the board received again
+
+
+def skillPacket(port, data):
+    """
+    the bytes to write for the encoded K skill: T if the port's board already holds the same skill.
+    The skill is assumed to be taken until forgetSkill() is called for a failed upload.
+    """
+    if not hasattr(port, 'lastSkill'):    # a port of the broker, the broker replaces the packet itself
+        return data
+    reader = port.Start_Reader()
+    if reader.rebooted:
+        reader.rebooted = False
+        port.lastSkill = None
+    digest = hashlib.blake2b(data, digest_size=16).digest()
+    if digest == port.lastSkill:
+        logger.debug("%s already holds the skill, replaying it with T", port.port)
+        return replaySkill
+    port.lastSkill = digest
+    return data
 
+
+def forgetSkill(port):
+    if hasattr(port, 'lastSkill'):
+        port.lastSkill = None
+
+
+def serialWriteNumToByte(port, token, var=None):  # Only to be used for c m u b I K L o within Python
+    logger.debug('serialWriteNumToByte, token=%s, var=%s', token, var)
+    if token.isupper():
+        in_str = getEncoder().encode(token, var)    # written before the buffer is reused
+        if token == 'K':
+            in_str = skillPacket(port, in_str)
     else:
-        if token.isupper():# == 'L' or token == 'I' or token == 'B' or token == 'C':
-#            if token == 'C':
-#                packType = 'B'
-#            else:
-#                packType = 'b'
-#            port.Send_data(token.encode())
-            if len(var)>0:
-                message = list(map(int, var))
-                if token == 'B':
-                    for l in range(len(message)//2):
-                        message[l*2+1]*= 8  #change 1 to 8 to save time for tests
-                        # print(message[l*2],end=",")
-                        # print(message[l*2+1],end=",")
-                        logger.debug(f"{message[l*2]},{message[l*2+1]}")
-            if token == 'W' or token == 'C':
-                in_str = struct.pack('B' * len(message), *message)    # B - unsigned char, e.g. 'B'*3 means 'BBB'
-            else:
-                in_str = struct.pack('b' * len(message), *message)    # b - signed char, e.g. 'b'*3 means 'bbb'
-            in_str = token.encode() + in_str + '~'.encode()
-
-        else:#if token == 'c' or token == 'm' or token == 'i' or token == 'b' or token == 'u' or token == 't':
-            message = ""
-            for element in var:
-                message +=  (str(round(element))+" ")
-            in_str = token.encode()+encode(message) +'\n'.encode()
-
-    slice = 0
-    while len(in_str) > slice:
-        if len(in_str) - slice >= 20:
-            port.Send_data(in_str[slice:slice+20])
-        else:
-            port.Send_data(in_str[slice:])
-        slice+=20
-        time.sleep(delayBetweenSlice)
-    logger.debug(f"!!!! {in_str}")
+        in_str = encodeNumToByte(token, var)
+    serialWriteSlices(port, in_str)
+    logger.debug("!!!! %s", in_str)
             #print(encode(in_str))
 #            port.Send_data(encode(message))
 
 
-def serialWriteByte(port, var=None):
-    logger.debug(f'serial_write_byte, var={var}')
+def encodeByte(var=None):
     if var is None:
         var = []
     token = var[0][0]
@@ -164,77 +165,103 @@ def serialWriteByte(port, var=None):
         in_str = var[0] + '\n'
     else:
         in_str = token + '\n'
-    logger.debug(f"!!!!!!! {in_str}")
+    return encode(in_str)
+
+
+def serialWriteByte(port, var=None):
+    logger.debug('serial_write_byte, var=%s', var)
+    in_str = encodeByte(var)
+    logger.debug("!!!!!!! %s", in_str)
     # printH("in_str:", in_str)
-    port.Send_data(encode(in_str))
+    port.Send_data(in_str)
     time.sleep(0.01)
 
 
-def printSerialMessage(port, token, timeout=0):
-    if token == 'k' or token == 'K':
-        threshold = 8
+def encodeTask(task):  # the bytes that sendTask writes for the task
+    if len(task) == 2:
+        return encodeByte([task[0]])
+    elif isinstance(task[1][0], int):
+        return encodeNumToByte(task[0], task[1])
     else:
-        threshold = 3
+        return encodeByte(task[1])
+
+
+def acceptedResponses(token):
     if 'X' in token:
         token = 'X'
-    startTime = time.time()
-    allPrints = ''
-    while True:
-        time.sleep(0.001)
-        #            return 'err'
-        if port:
-            response = port.main_engine.readline().decode('ISO-8859-1')
-            if response != '':
-                logger.debug(f"response is: {response}")
-                responseTrim = response.split('\r')[0]
-                logger.debug(f"responseTrim is: {responseTrim}")
-                if responseTrim.lower() == token.lower(): 
-                    return [response, allPrints]
-                elif token == 'p' and responseTrim == 'k':
-                    return [response, allPrints]
-                else:
-                    # print(response, flush=True)
-                    allPrints += response
-        now = time.time()
-        if (now - startTime) > threshold:
-            # print('Elapsed time: ', end='')
-            # print(threshold, end=' seconds\n', flush=True)
-            logger.debug(f"Elapsed time: {threshold} seconds")
-            threshold += 2
-            if threshold > 5:
-                return -1
-        if 0 < timeout < now - startTime:
-            return -1
+    if token == 'p':
+        return ('p', 'k')
+    return (token.lower(),)
+
+
+def responseTimeout(token, timeout=0, key=None, expected=0):
+    # key: (port name, the token or the skill name of a 'k' task), see adaptiveTimeout.taskKey()
+    # expected: estimated duration of the command, e.g. of a K skill
+    threshold = timeouts.deadline(key or (None, token), expected)
+    if threshold is None:    # not learned yet
+        if token == 'k' or token == 'K':
+            threshold = 8
+        else:
+            threshold = 5
+        threshold = max(threshold, expected * 2)
+    if 0 < timeout < threshold:
+        threshold = timeout
+    return threshold
 
 
-def sendTask(PortList, port, task, timeout=0):  # task Structure is [token, var=[], time]
-    logger.debug(f"{task}")
+def printSerialMessage(port, token, timeout=0, waiter=None, key=None, expected=0):
+    key = (getattr(port, 'port', None), key or token)    # each link learns its own deadlines
+    threshold = responseTimeout(token, timeout, key, expected)
+    if port:
+        reader = port.Start_Reader()
+        if waiter is None:
+            waiter = reader.expect(acceptedResponses(token))
+        result = waiter.result(threshold)
+        if result == -1:
+            reader.cancel(waiter)
+            port.metrics.timeouts += 1
+            timeouts.expired(key, threshold, expected)
+            logger.debug("Elapsed time: %s seconds", threshold)
+        else:
+            timeouts.record(key, waiter.completed - waiter.created, expected)
+            logger.debug("response is: %s", result[0])
+        return result
+    return -1
+
+
+def requestTask(PortList, port, task, timeout=0):  # write the task and wait for its echo, without the post-delay
+    logger.debug("%s", task)
     # printH("task:",task)
-    global returnValue
     #    global sync
     #    print(task)
     if port:
         try:
-            previousBuffer = port.main_engine.read_all().decode('ISO-8859-1')
-            if previousBuffer:
-                logger.debug(f"Previous buffer: {previousBuffer}")
-                pass
-            if len(task) == 2:
-                #        print('a')
-                #        print(task[0])
-                serialWriteByte(port, [task[0]])
-            elif isinstance(task[1][0], int):
-                #        print('b')
-                serialWriteNumToByte(port, task[0], task[1])
-            else:
-                #        print('c') #which case
-                serialWriteByte(port, task[1])
+            reader = port.Start_Reader()
             token = task[0][0]
+            with port.requestLock:
+                # another sender may be between its flush and its write
+                previousBuffer = reader.flush()
+                if previousBuffer:
+                    port.metrics.discardedBytes += len(previousBuffer)
+                    logger.debug("Previous buffer: %s", previousBuffer)
+                # register before writing so that a fast echo cannot be missed
+                waiter = reader.expect(acceptedResponses(token))
+                if len(task) == 2:
+                    #        print('a')
+                    #        print(task[0])
+                    serialWriteByte(port, [task[0]])
+                elif isinstance(task[1][0], int):
+                    #        print('b')
+                    serialWriteNumToByte(port, task[0], task[1])
+                else:
+                    #        print('c') #which case
+                    serialWriteByte(port, task[1])
 #            printH("token",token)
             if token == 'I' or token =='L':
                 timeout = 1 # in case the UI gets stuck
-            lastMessage = printSerialMessage(port, token, timeout)
-            time.sleep(task[-1])
+            lastMessage = printSerialMessage(port, token, timeout, waiter, taskKey(task), expectedDuration(task))
+            if token == 'K' and (lastMessage == -1 or 'OVF' in lastMessage[1]):
+                forgetSkill(port)
         #    with lock:
         #        sync += 1
         #        printH('sync',sync)
@@ -242,29 +269,187 @@ def sendTask(PortList, port, task, timeout=0):  # task Structure is [token, var=
         #        printH('thread',portDictionary[port])
         except Exception as e:
             #        printH('Fail to send to port',PortList[port])
+            if port.reader is not None:
+                port.reader.stop()
             if port in PortList:
                 PortList.pop(port)
             lastMessage = -1
     else:
         lastMessage = -1
-    returnValue = lastMessage
     return lastMessage
 
 
+def sendTask(PortList, port, task, timeout=0):  # task Structure is [token, var=[], time]
+    lastMessage = requestTask(PortList, port, task, timeout)
+    if port and (lastMessage != -1 or port in PortList):    # a port that failed to write is dropped without waiting
+        time.sleep(task[-1])
+    return lastMessage
+
+
+def uploadTask(PortList, port, task, progress=None, abort=None, timeout=0):
+    """
+    send a long binary task, e.g. a K skill or a B melody, in chunks that the link has taken.
+    progress(sent, total, bytesPerSecond) is called after every chunk, setting the abort event stops the upload.
+    A stopped upload is dropped by the firmware (ABT, see read_serial() in src/io.h) and the robot stands up,
+    so part of a skill never runs. A K skill that the board already holds is only replayed, see skillPacket().
+    Returns [response, allPrints] or -1
+    """
+    if not port:
+        return -1
+    token = task[0][0]
+    data = encodeBinary(token, task[1])
+    bufferSize = getattr(getattr(port, 'writer', None), 'bufferSize', None)
+    if bufferSize is not None and len(data) - 1 > bufferSize:
+        logger.info("%s: the %d bytes of %s don't fit in the board's buffer of %d", PortList.get(port), len(data) - 1,
+                    token, bufferSize)
+        return -1
+    if token == 'K':
+        data = skillPacket(port, data)
+    if abort is None:
+        abort = threading.Event()
+
+    def report(sent, total, bytesPerSecond):
+        try:
+            progress(sent, total, bytesPerSecond)
+        except Exception as e:    # e.g. the window showing the progress was closed
+            logger.info("Upload progress failed, stopping: %s", e)
+            abort.set()
+
+    reader = port.Start_Reader()
+    start = time.perf_counter()
+    try:
+        with port.requestLock:    # no other command may get between the chunks
+            previousBuffer = reader.flush()
+            if previousBuffer:
+                port.metrics.discardedBytes += len(previousBuffer)
+            waiter = reader.expect(acceptedResponses(token))
+            sent = port.Send_Packet(data, report if progress is not None else None, abort)
+            elapsed = time.perf_counter() - start
+            if sent < len(data):
+                if sent:    # wait for the firmware to drop the packet and to stand up
+                    standUp = reader.expect(('k',))
+                    for w in (waiter, standUp):
+                        if w.result(3) == -1:
+                            reader.cancel(w)
+                else:
+                    reader.cancel(waiter)
+                logger.info("Upload of %s stopped after %d of %d bytes", token, sent, len(data))
+                forgetSkill(port)
+                return -1
+    except Exception as e:
+        logger.info("Upload of %s failed: %s", token, e)
+        if port.reader is not None:
+            port.reader.stop()
+        if port in PortList:
+            PortList.pop(port)
+        return -1
+    result = printSerialMessage(port, token, timeout, waiter, taskKey(task), expectedDuration(task))
+    if result != -1:
+        logger.debug("Uploaded %d bytes at %.0f bytes/s", len(data), len(data) / max(elapsed, 1e-6))
+        if 'OVF' in result[1]:    # the firmware stood up instead
+            logger.info("%s overflowed the board's buffer", token)
+            forgetSkill(port)
+            return -1
+        time.sleep(task[-1])
+    else:
+        forgetSkill(port)
+    return result
+
+
+class PortWorker(threading.Thread):
+    """
+    Long-lived thread that sends the tasks of one port in order
+    """
+    def __init__(self, port):
+        super().__init__(daemon=True)
+        self.port = port
+        self.jobs = queue.Queue()
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            PortList, task, timeout, results, done = job
+            start = time.perf_counter()
+            # each worker only writes its own key, so one robot cannot overwrite another's result
+            try:
+                lastMessage = requestTask(PortList, self.port, task, timeout)
+                results[self.port] = {'result': lastMessage, 'latency': time.perf_counter() - start}
+                if lastMessage != -1 or self.port in PortList:
+                    time.sleep(task[-1])
+            except Exception as e:    # e.g. the robot was unplugged
+                logger.info("Fleet worker of %s failed: %s", PortList.get(self.port), e)
+                results[self.port] = {'result': -1, 'latency': time.perf_counter() - start}
+            finally:
+                done.set()    # the dispatcher waits for every port
+
+    def stop(self):
+        self.jobs.put(None)
+
+
+class FleetDispatcher(object):
+    """
+    Fans a task out to several ports through one persistent worker per port
+    """
+    def __init__(self):
+        self.workers = {}    # {SerialPort Object: PortWorker}
+        self.lock = threading.Lock()
+
+    def worker(self, port):
+        with self.lock:
+            w = self.workers.get(port)
+            if w is None or not w.is_alive():
+                w = self.workers[port] = PortWorker(port)
+                w.start()
+            return w
+
+    def dispatch(self, PortList, ports, task, timeout=0):
+        """
+        send the task to every port in parallel and wait for all of them,
+        return {SerialPort Object: {'result': [response, allPrints] or -1, 'latency': seconds}}
+        """
+        results = {}
+        waiting = list()
+        for p in ports:
+            done = threading.Event()
+            self.worker(p).jobs.put((PortList, task, timeout, results, done))
+            waiting.append(done)
+        for done in waiting:
+            done.wait()
+        self.prune(PortList)
+        return results
+
+    def prune(self, PortList):
+        # stop the workers of the ports that are no longer connected
+        with self.lock:
+            for p in [p for p in self.workers if p not in PortList]:
+                self.workers.pop(p).stop()
+
+    def stopAll(self):
+        with self.lock:
+            for w in self.workers.values():
+                w.stop()
+            self.workers.clear()
+
+
+fleet = FleetDispatcher()
+
+
+def sendFleet(ports, task, timeout=0):
+    # send one task to several robots at once, return the result and latency of each port
+    if isinstance(ports, dict):
+        ports = list(ports.keys())
+    return fleet.dispatch(goodPorts, ports, task, timeout)
+
+
 def sendTaskParallel(ports, task, timeout=0):
-    global returnValue
-    #    global sync
-    #    sync = 0
-    threads = list()
+    # the result of the first port that answered, as send() returns a single result
+    results = fleet.dispatch(goodPorts, ports, task, timeout)
     for p in ports:
-        t = threading.Thread(target=sendTask, args=(goodPorts, p, task, timeout))
-        threads.append(t)
-        t.daemon = True
-        t.start()
-    for t in threads:
-        if t.is_alive():
-            t.join()
-    return returnValue
+        if results[p]['result'] != -1:
+            return results[p]['result']
+    return -1
 
 
 def splitTaskForLargeAngles(task):
@@ -304,9 +489,9 @@ def send(port, task, timeout=0):
     queue = splitTaskForLargeAngles(task)
     for task in queue:
         # printH("task",task)
-        if len(port) > 1:
+        if len(p) > 1:    # the snapshot, ports may be added to the dictionary in the background
             returnResult = sendTaskParallel(p, task, timeout)
-        elif len(port) == 1:
+        elif len(p) == 1:
             returnResult = sendTask(goodPorts, p[0], task, timeout)
         else:
             # print('no ports')
@@ -314,6 +499,99 @@ def send(port, task, timeout=0):
     return returnResult
 
 
+skillTokens = ('k', 'K', 'T')
+
+
+def sendTaskPipeline(port, tasks, window=4, maxBytesInFlight=64, timeout=0):
+    # keep up to window tasks in flight without waiting for each echo.
+    # a task with a post-delay waits for all the echoes, then sleeps on the host side.
+    # maxBytesInFlight keeps the unacknowledged bytes within the board's serial receive buffer.
+    # returns the list of results in the same format as send().
+    # a failed task is marked by -1 and the tasks after it are not sent (None).
+    # the skills (k, K, T) are sent stop-and-wait: any serial input aborts a running behavior (see src/skill.h),
+    # so nothing may be written until its echo arrives.
+    results = [None] * len(tasks)
+    if not port:
+        return results
+    reader = port.Start_Reader()
+    with port.requestLock:
+        reader.flush()
+    inFlight = collections.deque()    # [task index, token, waiter, byte count]
+
+    def collect():
+        index, token, waiter, size = inFlight.popleft()
+        results[index] = printSerialMessage(port, token, 1 if token == 'I' or token == 'L' else timeout, waiter)
+        if token == 'K' and (results[index] == -1 or 'OVF' in results[index][1]):
+            forgetSkill(port)
+        if results[index] == -1:
+            logger.info("Task %d %s got no response", index, tasks[index])
+            return False
+        return True
+
+    def drain():
+        while inFlight:
+            if not collect():
+                return False
+        return True
+
+    try:
+        for index, task in enumerate(tasks):
+            for part in splitTaskForLargeAngles(copy.deepcopy(task)):
+                token = part[0][0]
+                in_str = encodeTask(part)
+                skill = token in skillTokens
+                if skill and not drain():
+                    return results
+                while len(inFlight) >= window or (inFlight and sum(t[3] for t in inFlight) + len(in_str) > maxBytesInFlight):
+                    if not collect():
+                        return results
+                with port.requestLock:
+                    if token == 'K':    # only now the skill is written, the board holds it from here on
+                        in_str = skillPacket(port, in_str)
+                    inFlight.append([index, token, reader.expect(acceptedResponses(token)), len(in_str)])
+                    if len(part) > 2 and isinstance(part[1][0], int):
+                        serialWriteSlices(port, in_str)
+                    else:
+                        port.Send_data(in_str)
+                if skill or part[-1] > 0:
+                    if not drain():
+                        return results
+                    time.sleep(part[-1])
+        drain()
+    except Exception as e:
+        logger.info("Pipeline stopped at task %d: %s", index, e)
+        results[index] = -1
+        forgetSkill(port)    # a K may have been cut short
+    finally:
+        for index, token, waiter, size in inFlight:
+            reader.cancel(waiter)
+            if token == 'K':
+                forgetSkill(port)
+    return results
+
+
+def sendPipeline(port, tasks, window=4, maxBytesInFlight=64, timeout=0):
+    # pipelined version of sending the tasks one by one with send().
+    # with several ports, returns a dictionary {port object: list of results}
+    if isinstance(port, dict):
+        p = list(port.keys())
+    else:
+        p = port
+    if len(p) == 1:
+        return sendTaskPipeline(p[0], tasks, window, maxBytesInFlight, timeout)
+    results = {}
+    threads = list()
+    for serialObject in p:
+        t = threading.Thread(target=lambda s: results.update({s: sendTaskPipeline(s, tasks, window, maxBytesInFlight, timeout)}),
+                             args=(serialObject,))
+        threads.append(t)
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
 def keepReadingInput(ports):
     while True and len(ports):
         time.sleep(0.001)
@@ -351,6 +629,7 @@ def closeAllSerial(ports, clearPorts=True):
 
     if clearPorts is True:
         ports.clear()
+        fleet.stopAll()
 
 
 balance = [
@@ -565,7 +844,16 @@ def schedulerToSkill(ports, testSchedule):
     #    sendTaskParallel(['K', newSkill, 1])
     send(ports, ['K', newSkill, 1])
 
-def getModelAndVersion(result):
+def boardOfVersion(version):
+    # the software version starts with N for NyBoard and B for BiBoard, e.g. N_240907
+    if version[:1] == 'N':
+        return 'NyBoard'
+    elif version[:1] == 'B':
+        return 'BiBoard'
+    return None
+
+
+def getModelAndVersion(result, serialObject=None):
     if result != -1:
         parse = result[1].replace('\r','').split('\n')
         for l in range(len(parse)):
@@ -575,6 +863,9 @@ def getModelAndVersion(result):
                 config.modelList += [config.model_]
                 print(config.model_)
                 print(config.version_)
+                if serialObject is not None:
+                    serialObject.Set_Board(boardOfVersion(config.version_))
+                    forgetSkill(serialObject)
                 return
     config.model_ = 'Bittle'
     config.version_ = 'Unknown'
@@ -603,8 +894,7 @@ def testPort(PortList, serialObject, p):
         waitTime = 0
         result = serialObject.main_engine
         if result != None:
-            result = result.read_all().decode('ISO-8859-1')
-            if result != '':
+            if result.read_all():
                 print('Waiting for the robot to boot up')
                 time.sleep(2)
                 waitTime = 3
@@ -613,9 +903,11 @@ def testPort(PortList, serialObject, p):
             result = sendTask(PortList, serialObject, ['?', 0], waitTime)
             if result != -1:
                 logger.debug(f"Adding in testPort: {p}")
-                PortList.update({serialObject: p})
-                goodPortCount += 1
-                getModelAndVersion(result)
+                with portListLock:
+                    PortList.update({serialObject: p})
+                    goodPortCount += 1
+                getModelAndVersion(result, serialObject)
+                portCache.remember(serialObject.port, config.model_, config.version_)
             else:
                 serialObject.Close_Engine()
                 print('* Port ' + p + ' is not connected to a Petoi device!')
@@ -624,6 +916,59 @@ def testPort(PortList, serialObject, p):
         print('* Port ' + p + ' cannot be opened!')
         raise e
 
+def probePort(PortList, serialObject, p):
+    # confirm a cached robot with a short '?' query instead of the start-up wait of testPort
+    global goodPortCount
+    if serialObject.main_engine is None:
+        return False
+    result = sendTask(PortList, serialObject, ['?', 0], 0.5)
+    if result == -1 and serialObject.reader is not None and (serialObject.reader.popUnsolicited() or serialObject.reader.flush()):
+        print('Waiting for the robot to boot up')    # opening the port has reset the board
+        time.sleep(2)
+        result = sendTask(PortList, serialObject, ['?', 0], 3)
+    if result == -1:
+        serialObject.Close_Engine()
+        portCache.forget(serialObject.port)
+        return False
+    logger.debug("Adding in probePort: %s", p)
+    with portListLock:
+        PortList.update({serialObject: p})
+        goodPortCount += 1
+    getModelAndVersion(result, serialObject)
+    portCache.remember(serialObject.port, config.model_, config.version_)
+    return True
+
+
+def scanUncached(PortList, ports):
+    # the full test of the ports quickConnect skipped, the robots found are added to PortList and portStrList
+    checkPortList(PortList, ports)
+    with portListLock:
+        connected = list(PortList.values())
+        for p in ports:
+            portName = p.split('/')[-1]
+            if portName in connected and portName not in portStrList:
+                logger.info("Connected to serial port: %s", p)
+                portStrList.append(portName)
+
+
+def quickConnect(PortList, allPorts=()):
+    # open the devices that answered before, returns False if none of them answers now.
+    # if one answers, the other ports of allPorts are tested in a background thread,
+    # so a robot that is not cached yet joins PortList a few seconds later.
+    connected = False
+    cached = list()
+    for device, entry in portCache.cachedPorts():
+        logger.debug("Cached port %s: %s", device, entry)
+        cached.append(device)
+        serialObject = Communication(device, 115200, 1)
+        if probePort(PortList, serialObject, device.split('/')[-1]):    # remove '/dev/' in the port name
+            connected = True
+    uncached = [p for p in allPorts if p not in cached]
+    if connected and uncached:
+        threading.Thread(target=scanUncached, args=(PortList, uncached), daemon=True).start()
+    return connected
+
+
 def checkPortList(PortList, allPorts, needTesting=True):
     threads = list()
     global goodPortCount
@@ -640,8 +985,9 @@ def checkPortList(PortList, allPorts, needTesting=True):
             t.start()
         else:
             logger.debug(f"Adding in checkPortList: {p}")
-            PortList.update({serialObject: p.split('/')[-1]})    # remove '/dev/' in the port name
-            goodPortCount += 1
+            with portListLock:
+                PortList.update({serialObject: p.split('/')[-1]})    # remove '/dev/' in the port name
+                goodPortCount += 1
             logger.info(f"Connected to serial port: {p}")
     if needTesting is True:
         for t in threads:
@@ -659,44 +1005,55 @@ def keepCheckingPort(portList, cond1=None, check=True, updateFunc = lambda:None)
     if cond1 is None:
         cond1 = lambda: len(portList) > 0
 
-    while cond1():
-        time.sleep(0.5)
-        currentPorts = Communication.Print_Used_Com()    # string list
-        # logger.debug(f"currentPorts is {currentPorts}")
-        
-        if set(currentPorts) - set(allPorts):
-            time.sleep(1) #usbmodem is slower in detection
-            currentPorts = Communication.Print_Used_Com()
-            # newPort = deleteDuplicatedUsbSerial(list(set(currentPorts) - set(allPorts)))
-            newPort = list(set(currentPorts) - set(allPorts))
-            if check:
+    watcher = hotplug.DevWatcher.open()    # None if the system has no hotplug events, then keep polling
+    try:
+        while cond1():
+            if watcher is None:
                 time.sleep(0.5)
-                checkPortList(portList, newPort)
-            else:
-                for p in newPort:
-                    logger.debug(f"Adding serial port: {p}")
-                    portName = p.split('/')[-1]
-                    portStrList.insert(0, portName)  # remove '/dev/' in the port name
-                    tk.messagebox.showinfo(title=txt('Info'), message=txt('New port prompt') + portName)
-            updateFunc()
-        elif set(allPorts) - set(currentPorts):
-            time.sleep(1) #usbmodem is slower in detection
-            currentPorts = Communication.Print_Used_Com()
-            closedPort = list(set(allPorts) - set(currentPorts))
-            if check:
-                inv_dict = {v: k for k, v in portList.items()}
-                for p in closedPort:
-                    if inv_dict.get(p.split('/')[-1], -1) != -1:
-                        logger.info(f"Removing {p.split('/')[-1]}")
-                        portList.pop(inv_dict[p.split('/')[-1]])
-            else:
-                for p in reversed(closedPort):
-                    portName = p.split('/')[-1]
-                    if portName in portStrList:
-                        logger.info(f"Removing serial port:{portName}")
-                        portStrList.remove(portName)
-            updateFunc()
-        allPorts = copy.deepcopy(currentPorts)
+            elif not watcher.wait(1):    # wakes up every second to check cond1
+                continue
+            currentPorts = Communication.Print_Used_Com()    # string list
+            # logger.debug(f"currentPorts is {currentPorts}")
+            
+            if set(currentPorts) - set(allPorts):
+                if watcher is None:
+                    time.sleep(1) #usbmodem is slower in detection
+                currentPorts = Communication.Print_Used_Com()
+                # newPort = deleteDuplicatedUsbSerial(list(set(currentPorts) - set(allPorts)))
+                newPort = list(set(currentPorts) - set(allPorts))
+                if check:
+                    time.sleep(0.5)
+                    checkPortList(portList, newPort)
+                else:
+                    for p in newPort:
+                        logger.debug(f"Adding serial port: {p}")
+                        portName = p.split('/')[-1]
+                        portStrList.insert(0, portName)  # remove '/dev/' in the port name
+                        loadGui().messagebox.showinfo(title=txt('Info'), message=txt('New port prompt') + portName)
+                updateFunc()
+            elif set(allPorts) - set(currentPorts):
+                if watcher is None:
+                    time.sleep(1) #usbmodem is slower in detection
+                currentPorts = Communication.Print_Used_Com()
+                closedPort = list(set(allPorts) - set(currentPorts))
+                if check:
+                    inv_dict = {v: k for k, v in portList.items()}
+                    for p in closedPort:
+                        if inv_dict.get(p.split('/')[-1], -1) != -1:
+                            logger.info(f"Removing {p.split('/')[-1]}")
+                            with portListLock:
+                                portList.pop(inv_dict[p.split('/')[-1]], None)
+                else:
+                    for p in reversed(closedPort):
+                        portName = p.split('/')[-1]
+                        if portName in portStrList:
+                            logger.info(f"Removing serial port:{portName}")
+                            portStrList.remove(portName)
+                updateFunc()
+            allPorts = copy.deepcopy(currentPorts)
+    finally:
+        if watcher is not None:
+            watcher.close()
 
 def showSerialPorts(allPorts):
     # currently an issue in pyserial where for newer raspiberry pi os
@@ -733,13 +1090,21 @@ def showSerialPorts(allPorts):
 def connectPort(PortList, needTesting=True, needSendTask=True, needOpenPort=True):
     global initialized
     global goodPortCount
+    if needOpenPort is True and brokerClient.attachPorts(PortList):
+        # the ports are shared by a running serialBroker.py, no handshake needed
+        logger.info("Connected to the serial broker: %s", list(PortList.values()))
+        portStrList.extend(PortList.values())
+        initialized = True
+        return
     allPorts = Communication.Print_Used_Com()
     showSerialPorts(allPorts)
 
     if len(allPorts) > 0:
         goodPortCount = 0
         if needOpenPort is True:
-            checkPortList(PortList, allPorts, needTesting)
+            # the full scan waits for every port to boot, so try the cached robots first
+            if needTesting is not True or not quickConnect(PortList, allPorts):
+                checkPortList(PortList, allPorts, needTesting)
     initialized = True
     if needOpenPort is True:
         if len(PortList) == 0:
@@ -749,10 +1114,12 @@ def connectPort(PortList, needTesting=True, needSendTask=True, needOpenPort=True
                 replug(PortList, needSendTask, needOpenPort)
         else:
             logger.info(f"Connect to serial port list:")
-            for p in PortList:
-                logger.debug(f"datatype of p : {type(p)}")
-                logger.info(f"{PortList[p]}")
-                portStrList.append(PortList[p])
+            with portListLock:    # the uncached ports may still be added by scanUncached
+                for p in PortList:
+                    logger.debug(f"datatype of p : {type(p)}")
+                    logger.info(f"{PortList[p]}")
+                    if PortList[p] not in portStrList:
+                        portStrList.append(PortList[p])
     else:
         if len(allPorts) == 0 or len(allPorts) > 1:
             print('Replug mode')
@@ -766,7 +1133,7 @@ def replug(PortList, needSendTask=True, needOpenPort=True):
     global timePassed
     print('Please disconnect and reconnect the device from the COMPUTER side')
     
-    window = tk.Tk()
+    window = loadGui().Tk()
     window.geometry('+800+500')
     def on_closing():
         window.destroy()
@@ -831,7 +1198,7 @@ def replug(PortList, needSendTask=True, needOpenPort=True):
                         if (needOpenPort is True) and (needSendTask is True):
                             time.sleep(2)
                             result = sendTask(PortList, serialObject, ['?', 0])
-                            getModelAndVersion(result)
+                            getModelAndVersion(result, serialObject)
                         
                         success = True
                     except Exception as e:
@@ -881,11 +1248,11 @@ def selectList(PortList,ls,win, needSendTask=True, needOpenPort=True):
             if (needOpenPort is True) and (needSendTask is True):
                 time.sleep(2)
                 result = sendTask(PortList, serialObject, ['?', 0])
-                getModelAndVersion(result)
+                getModelAndVersion(result, serialObject)
             win.withdraw()
 
         except Exception as e:
-            tk.messagebox.showwarning(title=txt('Warning'), message=txt('* Port ') + p + txt(' cannot be opened'))
+            loadGui().messagebox.showwarning(title=txt('Warning'), message=txt('* Port ') + p + txt(' cannot be opened'))
             print("Cannot open {}".format(p))
             raise e
     win.destroy()
@@ -893,6 +1260,7 @@ def selectList(PortList,ls,win, needSendTask=True, needOpenPort=True):
 def manualSelect(PortList, window, needSendTask=True, needOpenPort=True):
     # allPorts = deleteDuplicatedUsbSerial(Communication.Print_Used_Com())
     allPorts = Communication.Print_Used_Com()
+    loadGui()
     window.title(txt('Manual mode'))
     l1 = tk.Label(window, font = 'sans 14 bold')
     l1['text'] = txt('Manual mode')
@@ -925,10 +1293,11 @@ initialized = False
 goodPortCount = 0
 sync = 0
 lock = threading.Lock()
-returnValue = ''
+portListLock = threading.RLock()    # guards the updates of goodPorts, portStrList and goodPortCount from several threads
 timePassed = 0
 
 if __name__ == '__main__':
+    startLogging()
     try:
         connectPort(goodPorts)
         t = threading.Thread(target=keepCheckingPort, args=(goodPorts,))
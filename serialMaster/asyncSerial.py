@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# asyncio transport for the OpenCat serial protocol.
+# It uses the same encoding as ardSerial.send(), but the serial file descriptor is read and written
+# without blocking, so one event loop can drive many robots without a thread per port.
+#
+#   conn = await AsyncRobotConnection.open('/dev/ttyUSB0')
+#   await conn.send(['kbalance', 1])
+#   angles = await conn.query('j')
+#   async for line in conn:    # the lines nobody asked for
+#       print(line)
+
+import asyncio
+import collections
+import os
+import serial  # need to install pyserial first
+from SerialCommunication import ResponseWaiter
+from ardSerial import encodeTask, splitTaskForLargeAngles, acceptedResponses, responseTimeout, logger
+
+
+class AsyncRobotConnection(object):
+    """
+    Non-blocking connection to one robot, driven by the running event loop
+    """
+    def __init__(self, port, bps=115200, bufferSize=256):
+        if os.name != 'posix':
+            raise OSError('AsyncRobotConnection needs a POSIX serial file descriptor')
+        self.port = port
+        self.loop = asyncio.get_running_loop()
+        self.main_engine = serial.Serial(port, bps, timeout=0)
+        self.fd = self.main_engine.fileno()
+        self.wireRate = bps / 10.0  # bytes per second, 10 bits per byte on the wire
+        os.set_blocking(self.fd, False)
+        self.pending = bytearray()
+        self.waiters = collections.deque()    # [ResponseWaiter, future]
+        self.unsolicited = asyncio.Queue(maxsize=bufferSize)
+        self.sendLock = asyncio.Lock()
+        self.closed = False
+        self.loop.add_reader(self.fd, self.onReadable)
+
+    @classmethod
+    async def open(cls, port, bps=115200):
+        return cls(port, bps)
+
+    def onReadable(self):
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            logger.info("%s is disconnected: %s", self.port, e)
+            self.close()
+            return
+        if not data:
+            return
+        self.pending += data
+        start = 0
+        end = self.pending.find(b'\n')
+        while end >= 0:
+            self.dispatch(self.pending[start:end + 1])
+            start = end + 1
+            end = self.pending.find(b'\n', start)
+        del self.pending[:start]
+
+    def dispatch(self, line):
+        while self.waiters and self.waiters[0][1].done():    # drop the requests that timed out
+            self.waiters.popleft()
+        if self.waiters:
+            waiter, future = self.waiters[0]
+            if waiter.offer(line):
+                self.waiters.popleft()
+                future.set_result(waiter.result(0))
+        else:
+            if self.unsolicited.full():
+                self.unsolicited.get_nowait()    # keep the newest lines
+            self.unsolicited.put_nowait(line.decode('ISO-8859-1'))
+
+    async def write(self, data):
+        view = memoryview(data)
+        while len(view):
+            try:
+                n = os.write(self.fd, view)
+                view = view[n:]
+            except BlockingIOError:
+                writable = self.loop.create_future()
+                self.loop.add_writer(self.fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    self.loop.remove_writer(self.fd)
+
+    async def writeSliced(self, data):
+        # 20 byte slices paced at the wire speed, without blocking the loop
+        start = self.loop.time()
+        for slice in range(0, len(data), 20):
+            await self.write(data[slice:slice + 20])
+            wait = start + (slice + 20) / self.wireRate - self.loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+    async def sendTask(self, task, timeout=0):
+        token = task[0][0]
+        if token == 'I' or token == 'L':
+            timeout = 1    # in case the UI gets stuck
+        future = self.loop.create_future()
+        async with self.sendLock:
+            self.waiters.append([ResponseWaiter(acceptedResponses(token)), future])
+            data = encodeTask(task)
+            if len(task) > 2 and isinstance(task[1][0], int):
+                await self.writeSliced(data)
+            else:
+                await self.write(data)
+            try:
+                result = await asyncio.wait_for(future, responseTimeout(token, timeout))
+            except asyncio.TimeoutError:
+                logger.debug("%s: no response to %s", self.port, token)
+                result = -1
+        await asyncio.sleep(task[-1])
+        return result
+
+    async def send(self, task, timeout=0):
+        """
+        send a task in the same format as ardSerial.send(), return [response, allPrints] or -1
+        """
+        if self.closed:
+            return -1
+        result = -1
+        for t in splitTaskForLargeAngles(task):
+            result = await self.sendTask(t, timeout)
+        return result
+
+    async def query(self, token, timeout=0):
+        """
+        send a single token and return the text printed before its echo, or -1
+        """
+        result = await self.send([token, 0], timeout)
+        if result == -1:
+            return -1
+        return result[1]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        line = await self.unsolicited.get()
+        if line is None:    # put by close()
+            raise StopAsyncIteration
+        return line
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.loop.remove_reader(self.fd)
+        for waiter, future in self.waiters:
+            if not future.done():
+                future.set_result(-1)
+        self.waiters.clear()
+        if self.unsolicited.full():
+            self.unsolicited.get_nowait()
+        self.unsolicited.put_nowait(None)
+        self.main_engine.close()
@@ -0,0 +1,89 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Micro-benchmark of packetEncoder.py against the encoding that serialWriteNumToByte used to do on every call.
+# It doesn't need a robot:
+#   python3 benchEncoder.py
+
+import struct
+import timeit
+from packetEncoder import PacketEncoder
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def legacyEncode(token, var):  # the former body of serialWriteNumToByte, without writing to the port
+    if token == 'K':
+        var = list(var)
+        period = var[0]
+        if period > 0:
+            skillHeader = 4
+        else:
+            skillHeader = 7
+        if period > 1:
+            frameSize = 8  # gait
+        elif period == 1:
+            frameSize = 16  # posture
+        else:
+            frameSize = 20  # behavior
+        angleRatio = 1
+        for row in range(abs(period)):
+            for angle in var[skillHeader + row * frameSize:skillHeader + row * frameSize + min(16, frameSize)]:
+                if angle > 125 or angle < -125:
+                    angleRatio = 2
+                    break
+            if angleRatio == 2:
+                break
+        if angleRatio == 2:
+            var[3] = 2
+            for row in range(abs(period)):
+                for i in range(skillHeader + row * frameSize, skillHeader + row * frameSize + min(16, frameSize)):
+                    var[i] //= 2
+        var = list(map(int, var))
+        return token.encode() + struct.pack('b' * len(var), *var) + '~'.encode()
+    message = list(map(int, var))
+    if token == 'B':
+        for l in range(len(message) // 2):
+            message[l * 2 + 1] *= 8
+    if token == 'W' or token == 'C':
+        in_str = struct.pack('B' * len(message), *message)
+    else:
+        in_str = struct.pack('b' * len(message), *message)
+    return token.encode() + in_str + '~'.encode()
+
+
+longSkill = [-125, 0, 0, 1, 0, 0, 0] + [15, 0, 0, 0, 0, 0, 0, 0, 30, 35, 40, 29, 50, 15, 15, 15, 16, 0, 0, 0] * 125
+packets = {
+    'I 10 joints': ('I', [0, 10, 1, -20, 8, 30, 9, 30, 12, 40, 13, 40, 10, 30, 11, 30, 14, 40, 15, 40]),
+    'L 16 joints': ('L', [0, 0, 0, 0, 0, 0, 0, 0, 30, 30, 30, 30, 30, 30, 30, 30]),
+    'C color': ('C', [127, 0, 0, 0, 2]),
+    'B melody': ('B', [14, 4, 14, 4, 21, 4, 21, 4, 23, 4, 23, 4, 21, 2]),
+    'K 125 frames': ('K', longSkill),
+    'K large angles': ('K', [1, 0, 0, 1] + [0, 0, 0, 0, 0, 0, 0, 0, 130, 130, 30, 30, 30, 30, 30, 30]),
+}
+
+
+def bench(label, function, number):
+    seconds = min(timeit.repeat(function, number=number, repeat=5)) / number
+    print('{:<16}{:>10.2f} us'.format(label, seconds * 1e6), end='')
+    return seconds
+
+
+if __name__ == '__main__':
+    encoder = PacketEncoder()
+    for name, (token, var) in packets.items():
+        assert bytes(encoder.encode(token, var)) == legacyEncode(token, var), name
+        number = 200 if token == 'K' and len(var) > 100 else 20000
+        print(name)
+        old = bench('  legacy', lambda: legacyEncode(token, var), number)
+        print()
+        new = bench('  encoder', lambda: encoder.encode(token, var), number)
+        print('   x{:.1f}'.format(old / new))
+        if np is not None:
+            array = np.array(var, dtype=np.int16 if token == 'K' else np.int8)
+            assert bytes(encoder.encode(token, array)) == legacyEncode(token, var), name
+            new = bench('  encoder numpy', lambda: encoder.encode(token, array), number)
+            print('   x{:.1f}'.format(old / new))
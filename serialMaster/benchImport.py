@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Import time of the serial stack. Each import runs in a fresh interpreter, so the numbers include
+# everything a CLI script or a subprocess pays before it can talk to a robot:
+#   python3 benchImport.py [--runs 10] [--module ardSerial] [--output result.json]
+# The slowest modules are taken from "python -X importtime".
+# The exit status is 1 if the import loads one of the lazyModules, which the stack only imports when they are used.
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+lazyModules = ('numpy', 'tkinter', 'http.server', 'ctypes', 'csv', 'logging.handlers')
+
+
+def importSeconds(module, runs):
+    seconds = list()
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, '-c', 'import ' + module], cwd=here, check=True)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+def baselineSeconds(runs):
+    # the interpreter alone
+    return importSeconds('sys', runs)
+
+
+def slowestModules(module, count=10):
+    # cumulative microseconds per module reported by -X importtime
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module], cwd=here,
+                            stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    modules = list()
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            modules.append([fields[2].strip(), int(fields[1])])
+    modules.sort(key=lambda m: -m[1])
+    return modules[:count]
+
+
+def sideEffects(module):
+    # files created and modules loaded by the import
+    code = 'import json, os, sys; before = set(os.listdir(".")); import {}; ' \
+           'print(json.dumps(sorted(set(os.listdir(".")) - before))); ' \
+           'print(json.dumps([m for m in {} if m in sys.modules]))'.format(module, lazyModules)
+    lines = subprocess.run([sys.executable, '-c', code], cwd=here, stdout=subprocess.PIPE,
+                           universal_newlines=True, check=True).stdout.splitlines()
+    loaded = json.loads(lines[1])
+    return {'createdFiles': json.loads(lines[0]), 'tkinterLoaded': 'tkinter' in loaded, 'lazyModulesLoaded': loaded}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Import time of the serial stack')
+    parser.add_argument('--module', default='ardSerial')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--output', help='also write the JSON to this file')
+    args = parser.parse_args()
+
+    seconds = sorted(importSeconds(args.module, args.runs))
+    baseline = sorted(baselineSeconds(args.runs))
+    report = {
+        'meta': {'module': args.module, 'runs': args.runs, 'python': platform.python_version(),
+                 'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'importMs': {'min': seconds[0] * 1000, 'median': seconds[len(seconds) // 2] * 1000, 'max': seconds[-1] * 1000},
+        'interpreterMs': baseline[len(baseline) // 2] * 1000,
+        'slowestModulesUs': slowestModules(args.module),
+        'sideEffects': sideEffects(args.module),
+    }
+    text = json.dumps(report, indent=1)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    if report['sideEffects']['lazyModulesLoaded']:
+        sys.exit('Loaded at import: ' + ', '.join(report['sideEffects']['lazyModulesLoaded']))
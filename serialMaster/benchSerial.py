@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Round trip and throughput benchmark of the serial stack (ardSerial.py + SerialCommunication.py).
+# It runs against a robot, or against virtualRobot.py started in another process when no port is given,
+# and prints the results as JSON so that they can be compared across changes:
+#   python3 benchSerial.py [--port /dev/ttyUSB0] [--board BiBoard] [--iterations 200] [--output result.json]
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from ardSerial import send, sendTaskPipeline, Communication, closeAllSerial, forgetSkill
+
+balanceLegs = [30] * 8
+latencyTasks = {
+    'k': ['kbalance', 0],
+    'j': ['j', 0],
+    'I': ['I', [8, 30, 9, 30, 10, 30, 11, 30], 0],
+    'L': ['L', [0] * 8 + balanceLegs, 0],
+    'K posture': ['K', [1, 0, 0, 1] + [0] * 8 + balanceLegs, 0],
+}
+gaitFrames = [2, 8, 16, 32, 56]    # K sizes of 4 + 8 * frames bytes, the largest one fits the NyBoard's buffer
+
+
+def gaitSkill(frames):
+    # a gait that keeps the legs at the balance posture, so that the robot doesn't move between the tests
+    return ['K', [frames, 0, 0, 1] + balanceLegs * frames, 0]
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100.0 * (len(ordered) - 1))))]
+
+
+def summary(seconds, cpu):
+    n = len(seconds)
+    answered = [s for s in seconds if s is not None] or [0]
+    return {
+        'n': n,
+        'failures': n - len([s for s in seconds if s is not None]),
+        'p50': percentile(answered, 50) * 1000,
+        'p95': percentile(answered, 95) * 1000,
+        'p99': percentile(answered, 99) * 1000,
+        'mean': sum(answered) / len(answered) * 1000,
+        'cpuPerCommand': cpu / max(1, n) * 1000,
+    }
+
+
+def roundTrips(ports, task, iterations, replay=False):
+    # seconds of send() per task, None for a missing echo. the summary is in milliseconds
+    # a K skill is sent in full every time unless replay is set, then the board replays it with T after the first one
+    seconds = list()
+    cpu = time.process_time()
+    for i in range(iterations):
+        if not replay:
+            for p in ports:
+                forgetSkill(p)
+        start = time.perf_counter()
+        result = send(ports, list(task) if len(task) == 2 else [task[0], list(task[1]), task[2]])
+        seconds.append(time.perf_counter() - start if result != -1 else None)
+    return summary(seconds, time.process_time() - cpu)
+
+
+def jointRate(ports, seconds):
+    # L frames per second, waiting for each echo
+    frames = 0
+    cpu = time.process_time()
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        send(ports, ['L', [0] * 8 + [30 + frames % 2] * 8, 0])
+        frames += 1
+    elapsed = time.perf_counter() - start
+    return {'fps': frames / elapsed, 'cpuPerCommand': (time.process_time() - cpu) / max(1, frames) * 1000}
+
+
+def pipelinedJointRate(port, frames):
+    tasks = [['L', [0] * 8 + [30 + f % 2] * 8, 0] for f in range(frames)]
+    start = time.perf_counter()
+    results = sendTaskPipeline(port, tasks)
+    elapsed = time.perf_counter() - start
+    return {'fps': sum(1 for r in results if r not in (None, -1)) / elapsed}
+
+
+def uploadTimes(ports, iterations):
+    times = list()
+    for frames in gaitFrames:
+        task = gaitSkill(frames)
+        result = roundTrips(ports, task, iterations)
+        size = len(task[1]) + 2    # token and '~'
+        result.update({'bytes': size, 'bytesPerSecond': size / (result['p50'] / 1000) if result['p50'] else 0})
+        times.append(result)
+    return times
+
+
+def startEmulator(board):
+    robot = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'virtualRobot.py'),
+                              '--board', board], stdout=subprocess.PIPE, universal_newlines=True)
+    return robot, robot.stdout.readline().split()[-1]
+
+
+def waitForRobot(ports, seconds=5):
+    # a NyBoard restarts when the port is opened
+    deadline = time.time() + seconds
+    while time.time() < deadline:
+        if send(ports, ['?', 0], 1) != -1:
+            return True
+    return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the serial round trips')
+    parser.add_argument('--port', help='serial port of a robot, the virtual robot is used if omitted')
+    parser.add_argument('--board', default='NyBoard', help='board of the virtual robot')
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=3, help='duration of the joint rate test')
+    parser.add_argument('--output', help='also write the JSON to this file')
+    args = parser.parse_args()
+
+    emulator = None
+    port = args.port
+    if port is None:
+        emulator, port = startEmulator(args.board)
+    serialObject = Communication(port, 115200, 1)
+    ports = {serialObject: port.split('/')[-1]}
+    try:
+        if not waitForRobot(ports):
+            sys.exit('No robot answers on ' + port)
+        report = {
+            'meta': {'port': port, 'emulated': emulator is not None, 'board': args.board if emulator else None,
+                     'iterations': args.iterations, 'python': platform.python_version(),
+                     'platform': platform.platform(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'latency': {name: roundTrips(ports, task, args.iterations) for name, task in latencyTasks.items()},
+            'jointRate': jointRate(ports, args.seconds),
+            'pipelinedJointRate': pipelinedJointRate(serialObject, args.iterations),
+            'upload': uploadTimes(ports, max(1, args.iterations // 5)),
+            'replay': roundTrips(ports, gaitSkill(gaitFrames[-1]), max(1, args.iterations // 5), True),
+        }
+        send(ports, ['kbalance', 0])
+    finally:
+        closeAllSerial(ports, False)
+        if emulator is not None:
+            emulator.terminate()
+    text = json.dumps(report, indent=1)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
@@ -0,0 +1,320 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Client side of serialBroker.py.
+# When a broker is running, connectPort() fills the port list with BrokerPort objects instead of opening
+# the serial ports, so send(), sendPipeline(), the telemetry, etc. work unchanged and several tools can share
+# one robot. A BrokerPort looks like SerialCommunication.Communication to them: the requests registered with
+# Start_Reader().expect() are sent to the broker together with the bytes of the next Send_data(), and the
+# broker answers each of them with the echo it received, or -1.
+#
+# Protocol: one JSON object per line on a Unix domain socket, the bytes are ISO-8859-1 strings.
+#   client: {"op": "hello"}
+#   broker: {"op": "hello", "ports": ["ttyUSB0", ...], "model": "Bittle", "version": "...", "modelList": [...]}
+#   client: {"op": "request", "id": 1, "port": "ttyUSB0", "data": "kbalance\n", "packet": false, "expect": [["k"]]}
+#   broker: {"op": "result", "id": 1, "index": 0, "result": ["k\r\n", ""]}    (or "result": -1)
+#   client: {"op": "cancel", "id": 1}
+#   client: {"op": "subscribe"}
+#   broker: {"op": "line", "port": "ttyUSB0", "line": "..."}    a line that no request took
+
+import collections
+import json
+import os
+import socket
+import threading
+import time
+import config
+from SerialCommunication import ResponseWaiter, unsolicitedBufferSize
+from serialMetrics import metrics
+
+defaultSocket = os.path.join(os.path.expanduser('~'), '.config', 'Petoi', 'serialBroker.sock')
+enabled = True    # the broker itself opens the ports directly
+connection = None    # the shared BrokerConnection of this process
+
+
+def encodeMessage(message):
+    return (json.dumps(message) + '\n').encode()
+
+
+class BrokerConnection(threading.Thread):
+    """
+    The socket to the broker and the thread that reads its messages
+    """
+    def __init__(self, sock):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.sock = sock
+        self.file = sock.makefile('rb')
+        self.writeLock = threading.Lock()
+        self.lock = threading.Lock()
+        self.requests = {}    # id: [BrokerReader, [waiters]]
+        self.nextId = 0
+        self.ports = {}    # name: BrokerPort
+        self.hello = None
+        self.helloEvent = threading.Event()
+        self.subscribed = False
+        self.running = True
+
+    def write(self, message):
+        data = encodeMessage(message)
+        with self.writeLock:
+            self.sock.sendall(data)
+
+    def run(self):
+        try:
+            for line in self.file:
+                self.dispatch(json.loads(line.decode()))
+        except (OSError, ValueError):
+            pass
+        self.running = False
+        self.helloEvent.set()
+        with self.lock:
+            requests = list(self.requests.values())
+            self.requests.clear()
+        for reader, waiters in requests:
+            for waiter in waiters:
+                reader.done(waiter)
+                waiter.fail()
+
+    def dispatch(self, message):
+        op = message.get('op')
+        if op == 'result':
+            with self.lock:
+                request = self.requests.get(message['id'])
+                if request is None:
+                    return
+                reader, waiters = request
+                waiter = waiters[message['index']]
+                if message['index'] == len(waiters) - 1:
+                    del self.requests[message['id']]
+            reader.done(waiter)
+            result = message['result']
+            if result == -1:
+                waiter.fail()
+            else:
+                waiter.prints = bytearray(result[1].encode('ISO-8859-1'))
+                waiter.response = result[0].encode('ISO-8859-1')
+                waiter.completed = time.perf_counter()
+                waiter.event.set()
+        elif op == 'line':
+            port = self.ports.get(message['port'])
+            if port is not None and port.reader is not None:
+                port.reader.unsolicitedLine(message['line'])
+        elif op == 'hello':
+            self.hello = message
+            self.helloEvent.set()
+
+    def request(self, reader, name, data, packet, waiters):
+        with self.lock:
+            self.nextId += 1
+            id = self.nextId
+            if waiters:
+                self.requests[id] = [reader, waiters]
+        for waiter in waiters:
+            waiter.requestId = id
+        self.write({'op': 'request', 'id': id, 'port': name, 'data': bytes(data).decode('ISO-8859-1'),
+                    'packet': packet, 'expect': [list(w.accepted) for w in waiters]})
+
+    def cancel(self, waiter):
+        id = getattr(waiter, 'requestId', None)
+        with self.lock:
+            request = self.requests.pop(id, None)
+        if request is not None:
+            try:
+                self.write({'op': 'cancel', 'id': id})
+            except OSError:
+                pass
+            reader, waiters = request
+            for w in waiters:
+                if w is not waiter:
+                    reader.done(w)
+                    w.fail()
+
+    def subscribe(self):
+        if not self.subscribed:
+            self.subscribed = True
+            self.write({'op': 'subscribe'})
+
+    def close(self):
+        self.running = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class BrokerReader(object):
+    """
+    Stands in for SerialCommunication.SerialReader on a BrokerPort
+    """
+    def __init__(self, port):
+        self.port = port
+        self.lock = threading.Lock()
+        self.waiters = collections.deque()    # requests waiting for their echo
+        self.staged = list()    # registered requests whose command is not written yet
+        self.unsolicited = collections.deque(maxlen=unsolicitedBufferSize)
+        self.listeners = []
+        self.running = True
+
+    def is_alive(self):
+        return self.running and self.port.connection.running
+
+    def expect(self, accepted):
+        waiter = ResponseWaiter(accepted)
+        with self.lock:
+            if self.is_alive():
+                self.waiters.append(waiter)
+                self.staged.append(waiter)
+            else:
+                waiter.fail()
+        return waiter
+
+    def takeStaged(self):
+        with self.lock:
+            staged = self.staged
+            self.staged = list()
+        return staged
+
+    def done(self, waiter):
+        with self.lock:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    def cancel(self, waiter):
+        with self.lock:
+            if waiter in self.staged:
+                self.staged.remove(waiter)
+        self.done(waiter)
+        self.port.connection.cancel(waiter)
+
+    def unsolicitedLine(self, line):
+        if self.listeners:
+            data = line.encode('ISO-8859-1')    # the listeners take bytes, as from SerialReader
+            for listener in self.listeners:
+                if listener(data):
+                    return
+        self.unsolicited.append(line)
+
+    def addListener(self, listener):
+        with self.lock:
+            self.listeners = self.listeners + [listener]
+        self.port.connection.subscribe()
+
+    def removeListener(self, listener):
+        with self.lock:
+            self.listeners = [l for l in self.listeners if l is not listener]
+
+    def flush(self):
+        # the broker keeps the unfinished lines of the port
+        return ''
+
+    def popUnsolicited(self):
+        with self.lock:
+            lines = list(self.unsolicited)
+            self.unsolicited.clear()
+        return lines
+
+    def stop(self):
+        self.running = False
+
+
+class BrokerPort(object):
+    """
+    A serial port of the broker, used like SerialCommunication.Communication.
+    It has no lastSkill: the broker replays a K skill with T for all its clients (see ardSerial.skillPacket)
+    """
+    def __init__(self, connection, name):
+        self.connection = connection
+        self.port = name
+        self.main_engine = connection    # not None: the port is open
+        self.requestLock = threading.RLock()
+        self.reader = None
+        self.metrics = metrics.port('broker:' + name)
+        self.metrics.attach(self)
+
+    def Start_Reader(self):
+        with self.requestLock:
+            if self.reader is None or not self.reader.running:
+                self.reader = BrokerReader(self)
+            return self.reader
+
+    def write(self, data, packet):
+        self.metrics.sent(data)
+        waiters = self.Start_Reader().takeStaged()
+        self.connection.request(self.reader, self.port, data, packet, waiters)
+
+    def Send_data(self, data):
+        self.write(data, False)
+
+    def Send_Packet(self, data, progress=None, abort=None):
+        # the broker paces the packet, so the progress is only known at the end
+        if abort is not None and abort.is_set():
+            return 0
+        self.write(data, True)
+        if progress is not None:
+            progress(len(data), len(data), 0)
+        return len(data)
+
+    def Set_Board(self, board):
+        pass    # the broker paces the packets for the board
+
+    def Close_Engine(self):
+        if self.reader is not None:
+            self.reader.stop()
+        self.connection.ports.pop(self.port, None)
+        if not self.connection.ports:
+            closeConnection()
+
+
+def connect(path=defaultSocket, timeout=1):
+    """
+    connect to the broker, returns the BrokerConnection or None if no broker is running
+    """
+    global connection
+    if connection is not None and connection.running:
+        return connection
+    if not enabled or not hasattr(socket, 'AF_UNIX') or not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        sock.settimeout(None)
+    except OSError:
+        sock.close()
+        return None
+    candidate = BrokerConnection(sock)
+    candidate.start()
+    candidate.write({'op': 'hello'})
+    if not candidate.helloEvent.wait(timeout) or candidate.hello is None:
+        candidate.close()
+        return None
+    connection = candidate
+    return connection
+
+
+def closeConnection():
+    global connection
+    if connection is not None:
+        connection.close()
+        connection = None
+
+
+def attachPorts(PortList, path=defaultSocket):
+    """
+    add the broker's ports to PortList {port object: name}, returns False if there is no broker or no port
+    """
+    broker = connect(path)
+    if broker is None or not broker.hello['ports']:
+        return False
+    for name in broker.hello['ports']:
+        port = broker.ports.get(name)
+        if port is None:
+            port = broker.ports[name] = BrokerPort(broker, name)
+        PortList[port] = name
+    if broker.hello.get('model'):
+        config.model_ = broker.hello['model']
+        config.version_ = broker.hello.get('version', '')
+        config.modelList = broker.hello.get('modelList', config.modelList)
+    return True
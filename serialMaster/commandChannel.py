@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Latest-wins command channel for the producers that are faster than the serial link, e.g. slider drags.
+# put() only stores the value under its key and returns at once. A background thread delivers the pending
+# values as soon as the previous delivery got its echoes, so the link runs at its own capacity and an older
+# value that was not sent yet is replaced by the newer one of the same key instead of queuing up:
+#   calib = keyedChannel(goodPorts, 'c')
+#   calib.put(8, 30)    # sends ['c', [8, 30], 0] unless a newer value of joint 8 comes first
+#   joints = jointChannel(goodPorts)
+#   joints.put(8, 140)    # the pending joints are sent together, as I or i
+
+import threading
+import time
+from ardSerial import send, logger
+from jointState import jointPairsTasks
+
+
+class LatestChannel(object):
+    """
+    Keeps the newest pending value per key and hands them to deliver(batch) from a worker thread.
+    batch is a dict {key: value} in the order the keys were first put.
+    minInterval optionally caps the rate of the deliveries (seconds between them).
+    """
+    def __init__(self, deliver, minInterval=0):
+        self.deliver = deliver
+        self.minInterval = minInterval
+        self.pending = {}
+        self.condition = threading.Condition()
+        self.busy = False
+        self.running = True
+        self.puts = 0
+        self.deliveries = 0
+        self.replaced = 0    # values dropped because a newer one of the same key came before they were sent
+        self.deliveryTime = 0.0    # moving average of the seconds per delivery
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, key, value):
+        with self.condition:
+            if key in self.pending:
+                self.replaced += 1
+            self.pending[key] = value
+            self.puts += 1
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.running and not self.pending:
+                    return
+                batch = self.pending
+                self.pending = {}
+                self.busy = True
+            start = time.perf_counter()
+            try:
+                self.deliver(batch)
+            except Exception as e:
+                logger.info("Channel delivery failed: %s", e)
+            elapsed = time.perf_counter() - start
+            self.deliveryTime = elapsed if not self.deliveries else 0.8 * self.deliveryTime + 0.2 * elapsed
+            self.deliveries += 1
+            if elapsed < self.minInterval:
+                time.sleep(self.minInterval - elapsed)
+            with self.condition:
+                self.busy = False
+                self.condition.notify_all()
+
+    def rate(self):
+        """
+        measured deliveries per second that the link sustains
+        """
+        return 1 / self.deliveryTime if self.deliveryTime else 0
+
+    def flush(self, timeout=None):
+        """
+        wait until the pending values are delivered, e.g. before sending another command that depends on them
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.pending or self.busy:
+                wait = None if deadline is None else deadline - time.time()
+                if wait is not None and wait <= 0:
+                    return False
+                self.condition.wait(wait)
+        return True
+
+    def close(self, timeout=1):
+        self.flush(timeout)
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+
+def keyedChannel(ports, token, onResult=None):
+    """
+    a channel that sends [token, [key, value], 0] for every pending key, e.g. 'c' for the calibration offsets
+    """
+    def deliver(batch):
+        for key, value in batch.items():
+            result = send(ports, [token, [key, value], 0])
+            if onResult is not None:
+                onResult(result)
+    return LatestChannel(deliver)
+
+
+def jointChannel(ports, onResult=None):
+    """
+    a channel of joint angles keyed by the joint index, the pending joints are sent together
+    """
+    def deliver(batch):
+        for task in jointPairsTasks([n for pair in batch.items() for n in pair]):
+            result = send(ports, task)
+            if onResult is not None:
+                onResult(result)
+    return LatestChannel(deliver)
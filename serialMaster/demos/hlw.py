@@ -70,9 +70,7 @@ if __name__ == '__main__':
         parallel = False # we are not controlling multiple robots in this demo
 #        if len(goodPorts)>0:
         time.sleep(2);
-        for task in testSchedule:  # execute the tasks in the testSchedule
-            print(task)
-            send(goodPorts, task)
+        sendPipeline(goodPorts, testSchedule) # execute the tasks in the testSchedule without waiting for every echo
         closeAllSerial(goodPorts)
         logger.info("finish!")
         os._exit(0)
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Serial port hotplug events on Linux.
+# inotify reports the tty nodes that udev creates and removes in /dev, so keepCheckingPort
+# only lists the ports after a device is plugged or unplugged instead of every 0.5 s.
+# On the other systems, or if inotify is not available, DevWatcher.open() returns None
+# and keepCheckingPort keeps polling.
+
+import os
+import select
+import struct
+import sys
+import time
+
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+eventHeader = struct.Struct('iIII')    # wd, mask, cookie, len, followed by the name
+serialPrefixes = ('tty', 'rfcomm')
+settleTime = 0.1    # udev creates the nodes of one device in a burst
+
+
+class DevWatcher(object):
+    """
+    Waits for serial device nodes to appear in or disappear from /dev
+    """
+    def __init__(self, fd):
+        self.fd = fd
+
+    @classmethod
+    def open(cls, path='/dev'):
+        if not sys.platform.startswith('linux'):
+            return None
+        try:
+            import ctypes    # only where inotify can be used
+            import ctypes.util
+            libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                return None
+            if libc.inotify_add_watch(fd, path.encode(), IN_CREATE | IN_DELETE) < 0:
+                os.close(fd)
+                return None
+        except (OSError, AttributeError):
+            return None
+        return cls(fd)
+
+    def readEvents(self):
+        # True if any of the pending events is about a serial device
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return False
+        found = False
+        offset = 0
+        while offset + eventHeader.size <= len(data):
+            wd, mask, cookie, length = eventHeader.unpack_from(data, offset)
+            offset += eventHeader.size
+            name = data[offset:offset + length].rstrip(b'\0').decode('ISO-8859-1')
+            offset += length
+            if name.startswith(serialPrefixes):
+                found = True
+        return found
+
+    def wait(self, timeout):
+        """
+        block until a serial device is added or removed, or until the timeout.
+        returns True if there was such an event.
+        """
+        found = False
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = settleTime if found else deadline - time.monotonic()
+            if wait <= 0 or not select.select([self.fd], [], [], wait)[0]:
+                return found
+            if self.readEvents():
+                found = True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
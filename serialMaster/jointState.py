@@ -0,0 +1,114 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Joint updates with the fewest bytes on the wire.
+# A new 16 joint target is compared with the last state sent, and only the changed joints are sent with
+#   L: all 16 angles, 18 bytes
+#   I: index/angle pairs, 2 + 2 * n bytes
+#   i: the ASCII version of I, the only one that takes angles beyond +-125
+# or with an I/L command for the angles within the binary range followed by an i for the others,
+# whichever is the shortest (counting the echo of each command):
+#   joints = JointState(goodPorts)
+#   joints.update(target)    # target: 16 angles
+#   joints.setJoints([8, 30, 9, 30])    # index/angle pairs
+
+import threading
+from ardSerial import send, encodeNumToByte
+from packetEncoder import angleLimit
+
+DOF = 16
+echoSize = 3    # the token, '\r' and '\n'
+
+
+def inRange(angle):
+    return -angleLimit <= angle <= angleLimit
+
+
+def taskSize(task):
+    # bytes of the command and its echo
+    if task[0] in 'LI':
+        return len(task[1]) + 2 + echoSize
+    return len(encodeNumToByte(task[0], task[1])) + echoSize
+
+
+def jointUpdateTasks(previous, target, delay=0):
+    """
+    the tasks that move the joints from previous to target with the fewest bytes,
+    previous is None if the current angles are unknown. the last task has the delay
+    """
+    target = [int(round(a)) for a in target]
+    changed = [i for i in range(DOF) if previous is None or int(round(previous[i])) != target[i]]
+    if not changed:
+        return []
+    pairs = [n for i in changed for n in (i, target[i])]
+    large = [n for i in changed if not inRange(target[i]) for n in (i, target[i])]
+    small = [n for i in changed if inRange(target[i]) for n in (i, target[i])]
+    candidates = [[['i', pairs, delay]]]
+    if not large:
+        candidates.append([['I', pairs, delay]])
+    if small:
+        candidates.append([['I', small, 0], ['i', large, delay]] if large else [['I', small, delay]])
+    outOfRange = [i for i in range(DOF) if not inRange(target[i])]
+    if all(i in changed for i in outOfRange):
+        # the joints beyond the binary range are clamped in the list, then set again with i
+        clamped = [max(min(a, angleLimit), -angleLimit) for a in target]
+        candidates.append([['L', clamped, 0], ['i', large, delay]] if large else [['L', target, delay]])
+    return min(candidates, key=lambda tasks: sum(taskSize(t) for t in tasks))
+
+
+def jointPairsTasks(pairs, delay=0):
+    """
+    the shortest tasks for index/angle pairs when the other joints are unknown
+    """
+    angles = dict(zip(pairs[0::2], pairs[1::2]))
+    if len(angles) == DOF:
+        return jointUpdateTasks(None, [angles[i] for i in range(DOF)], delay)
+    pairs = [n for pair in angles.items() for n in pair]
+    return [['I' if all(inRange(a) for a in pairs[1::2]) else 'i', pairs, delay]] if pairs else []
+
+
+class JointState(object):
+    """
+    Shadow copy of the angles last sent to the ports, so that an update only sends what changed
+    """
+    def __init__(self, ports, angles=None):
+        self.ports = ports
+        self.angles = None if angles is None else [int(round(a)) for a in angles]    # None when unknown
+        self.lock = threading.Lock()
+
+    def invalidate(self):
+        # call it after the robot moved by other commands, e.g. a skill
+        with self.lock:
+            self.angles = None
+
+    def update(self, target, delay=0):
+        """
+        move the joints to the 16 target angles, returns the result of the last command, None if nothing changed
+        """
+        if len(target) != DOF:
+            raise ValueError('a joint update needs ' + str(DOF) + ' angles')
+        with self.lock:
+            result = None
+            for task in jointUpdateTasks(self.angles, target, delay):
+                result = send(self.ports, task)
+                if result == -1:
+                    self.angles = None
+                    return result
+            self.angles = [int(round(a)) for a in target]
+            return result
+
+    def setJoints(self, pairs, delay=0):
+        """
+        move the joints given as index/angle pairs, the others keep their last angles
+        """
+        with self.lock:
+            current = self.angles
+        if current is None:    # only the given joints are known, send them as they are
+            result = None
+            for task in jointPairsTasks(pairs, delay):
+                result = send(self.ports, task)
+            return result
+        target = list(current)
+        for i in range(0, len(pairs) - 1, 2):
+            target[pairs[i]] = pairs[i + 1]
+        return self.update(target, delay)
@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Encoder for the binary tokens (K, L, I, M, B, C, W, R ...).
+# The packet is packed into a reusable buffer by a struct.Struct that is compiled once per length,
+# so a control loop sending the same kind of packet hundreds of times a second allocates nothing.
+# int8 NumPy arrays are copied into the buffer directly.
+
+import struct
+import sys
+import threading
+
+unsignedTokens = 'CW'    # tokens whose data are unsigned char
+angleLimit = 125    # '~' (126) terminates a binary command, so angles must stay within +-125
+
+
+def arrayModule(var):
+    # numpy if var is a NumPy array, else None. An array only comes from a program that has imported NumPy
+    # already, so it is looked up instead of imported, and importing the encoder costs nothing without it
+    np = sys.modules.get('numpy')
+    if np is not None and isinstance(var, np.ndarray):
+        return np
+    return None
+
+
+def skillLayout(period):
+    # header length and frame size of the K skill data
+    skillHeader = 4 if period > 0 else 7
+    if period > 1:
+        frameSize = 8  # gait
+    elif period == 1:
+        frameSize = 16  # posture
+    else:
+        frameSize = 20  # behavior
+    return skillHeader, frameSize
+
+
+class PacketEncoder(object):
+    """
+    Packs token + data + '~' into a reusable buffer.
+    The memoryview returned by encode() is only valid until the next call on the same encoder.
+    """
+    def __init__(self, size=512):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.structs = {'b': {}, 'B': {}}    # {type: {length: struct.Struct}}
+
+    def getStruct(self, type, length):
+        structs = self.structs[type]
+        s = structs.get(length)
+        if s is None:
+            s = structs[length] = struct.Struct(type * length)
+        return s
+
+    def reserve(self, length):
+        if len(self.buffer) < length:
+            self.buffer = bytearray(max(length, 2 * len(self.buffer)))
+            self.view = memoryview(self.buffer)
+
+    def pack(self, token, var, type='b'):
+        length = len(var)
+        if length + 2 > len(self.buffer):
+            self.reserve(length + 2)
+        buffer = self.buffer
+        buffer[0] = ord(token)
+        np = arrayModule(var)
+        if np is not None:
+            buffer[1:length + 1] = var.astype(np.uint8 if type == 'B' else np.int8, copy=False).tobytes()
+        else:
+            s = self.getStruct(type, length)
+            try:
+                s.pack_into(buffer, 1, *var)
+            except struct.error:    # float elements
+                s.pack_into(buffer, 1, *map(int, var))
+        buffer[length + 1] = 126    # '~'
+        return self.view[:length + 2]
+
+    def encodeSkill(self, var):
+        period = int(var[0])
+        skillHeader, frameSize = skillLayout(period)
+        rows = range(skillHeader, skillHeader + abs(period) * frameSize, frameSize)
+        angles = min(16, frameSize)
+        np = arrayModule(var)
+        if np is not None:
+            frames = var[skillHeader:skillHeader + abs(period) * frameSize].reshape(abs(period), frameSize)[:, :angles]
+            if frames.size and (frames.max() > angleLimit or frames.min() < -angleLimit):
+                var = var.astype(np.int16)
+                var[3] = 2
+                frames = var[skillHeader:skillHeader + abs(period) * frameSize].reshape(abs(period), frameSize)
+                frames[:, :angles] //= 2
+        else:
+            for row in rows:
+                frame = var[row:row + angles]
+                if max(frame) > angleLimit or min(frame) < -angleLimit:
+                    var = list(var)
+                    var[3] = 2
+                    for r in rows:
+                        var[r:r + angles] = [a // 2 for a in var[r:r + angles]]
+                    break
+        return self.pack('K', var)
+
+    def encode(self, token, var):
+        """
+        encode a binary token with its list (or NumPy array) of numbers
+        """
+        if token == 'K':
+            return self.encodeSkill(var)
+        if token == 'B':
+            var = [int(v) for v in var]
+            for l in range(1, len(var), 2):
+                var[l] *= 8  # change 1 to 8 to save time for tests
+        return self.pack(token, var, 'B' if token in unsignedTokens else 'b')
+
+
+encoders = threading.local()
+
+
+def getEncoder():
+    # one encoder per thread, because the buffer is reused
+    encoder = getattr(encoders, 'encoder', None)
+    if encoder is None:
+        encoder = encoders.encoder = PacketEncoder()
+    return encoder
+
+
+def encodeBinary(token, var):
+    """
+    bytes of a binary command, safe to keep after the next call
+    """
+    return bytes(getEncoder().encode(token, var))
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Fingerprints of the USB serial devices that answered as Petoi robots.
+# A device is identified by its USB VID, PID and serial number, so it is found again
+# when the operating system gives it another port name.
+# The cache is kept in ~/.config/Petoi/portCache.json, next to the UI's defaultConfig.txt.
+
+import json
+import os
+import time
+import serial.tools.list_ports
+
+cacheDir = os.path.join(os.path.expanduser('~'), '.config', 'Petoi')
+cachePath = os.path.join(cacheDir, 'portCache.json')
+maxEntries = 16
+
+
+def fingerprint(info):
+    # None for the ports that are not USB devices, such as /dev/ttyS0
+    if info.vid is None:
+        return None
+    return '{:04X}:{:04X}:{}'.format(info.vid, info.pid, info.serial_number or '')
+
+
+def loadCache():
+    try:
+        with open(cachePath) as f:
+            cache = json.load(f)
+        if isinstance(cache, dict):
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {}
+
+
+def saveCache(cache):
+    try:
+        os.makedirs(cacheDir, exist_ok=True)
+        temp = cachePath + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(cache, f, indent=1)
+        os.replace(temp, cachePath)    # never leave a half written cache
+    except OSError:
+        pass
+
+
+def portInfo(device):
+    for info in serial.tools.list_ports.comports():
+        if info.device == device:
+            return info
+    return None
+
+
+def remember(device, model, version):
+    """
+    save the fingerprint of a device that answered the '?' query
+    """
+    info = portInfo(device)
+    key = fingerprint(info) if info is not None else None
+    if key is None:
+        return
+    cache = loadCache()
+    cache[key] = {'device': device, 'model': model, 'version': version, 'lastSeen': time.time()}
+    if len(cache) > maxEntries:
+        for old in sorted(cache, key=lambda k: cache[k].get('lastSeen', 0))[:len(cache) - maxEntries]:
+            cache.pop(old)
+    saveCache(cache)
+
+
+def forget(device):
+    cache = loadCache()
+    for key in [k for k in cache if cache[k].get('device') == device]:
+        cache.pop(key)
+    saveCache(cache)
+
+
+def cachedPorts():
+    """
+    the connected devices whose fingerprints are cached, the most recently seen first
+    returns a list of [device, {'model', 'version', ...}]
+    """
+    cache = loadCache()
+    if not cache:
+        return []
+    found = list()
+    for info in serial.tools.list_ports.comports():
+        key = fingerprint(info)
+        if key in cache:
+            found.append([info.device, cache[key]])
+    found.sort(key=lambda f: f[1].get('lastSeen', 0), reverse=True)
+    return found
@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Serial broker: one process owns the robot's serial ports and the tools share them through a Unix domain socket,
+# so starting a tool doesn't repeat the connection handshake and a telemetry client can run next to a controller.
+#   python3 serialBroker.py [--port /dev/ttyUSB0] [--socket ~/.config/Petoi/serialBroker.sock]
+# Without --port it connects like the tools do with connectPort(). The tools find the broker in connectPort(),
+# see brokerClient.py for the protocol. Every request is registered on the port's reader in the order of its
+# write, so the echoes go back to the client that sent the command.
+
+import argparse
+import json
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import brokerClient
+from brokerClient import defaultSocket, encodeMessage
+
+brokerClient.enabled = False    # the broker opens the ports itself
+import ardSerial
+from ardSerial import Communication, connectPort, keepCheckingPort, logger, startLogging
+import config
+
+maxWait = 60    # seconds a request waits for its echo on the broker side, the client usually gives up earlier
+lineQueueSize = 1024    # lines a subscribed client may fall behind before the newer ones are dropped
+
+
+class BrokerSession(socketserver.StreamRequestHandler):
+    """
+    One client connection
+    """
+    def setup(self):
+        socketserver.StreamRequestHandler.setup(self)
+        self.writeLock = threading.Lock()
+        self.requests = {}    # id: [port, [waiters], skill]
+        self.requestsLock = threading.Lock()
+        self.subscriptions = list()    # [reader, listener]
+        self.lines = None    # the unsolicited lines waiting to be written by the session's forwarding thread
+        self.dropped = 0
+        self.open = True
+
+    def reply(self, message):
+        try:
+            with self.writeLock:
+                self.wfile.write(encodeMessage(message))
+                self.wfile.flush()
+        except (OSError, ValueError):
+            self.open = False
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line.decode())
+            except ValueError:
+                continue
+            op = message.get('op')
+            if op == 'hello':
+                self.reply({'op': 'hello', 'ports': list(self.server.ports.values()), 'model': config.model_,
+                            'version': config.version_, 'modelList': config.modelList})
+            elif op == 'request':
+                self.handleRequest(message)
+            elif op == 'cancel':
+                self.cancelRequest(message['id'])
+            elif op == 'subscribe':
+                self.subscribe()
+
+    def handleRequest(self, message):
+        port = self.server.portByName(message['port'])
+        if port is None:
+            for index in range(len(message['expect'])):
+                self.reply({'op': 'result', 'id': message['id'], 'index': index, 'result': -1})
+            return
+        reader = port.Start_Reader()
+        data = message['data'].encode('ISO-8859-1')
+        skill = bool(message.get('packet')) and data[:1] == b'K'
+        with port.requestLock:
+            if skill:    # the broker keeps the digest of the skill each board holds, whichever client sent it
+                data = ardSerial.skillPacket(port, data)
+            waiters = [reader.expect(tuple(accepted)) for accepted in message['expect']]
+            if waiters:
+                with self.requestsLock:
+                    self.requests[message['id']] = [port, waiters, skill]
+            try:
+                if message.get('packet'):
+                    port.Send_Packet(data)
+                else:
+                    port.Send_data(data)
+            except Exception as e:
+                logger.info("Broker failed to write to %s: %s", message['port'], e)
+                if skill:
+                    ardSerial.forgetSkill(port)
+                for waiter in waiters:
+                    reader.cancel(waiter)
+                    waiter.fail()
+        if waiters:
+            threading.Thread(target=self.collect, args=(message['id'], port, waiters, skill), daemon=True).start()
+
+    def collect(self, id, port, waiters, skill):
+        for index, waiter in enumerate(waiters):
+            result = waiter.result(maxWait)
+            if result == -1:
+                port.reader.cancel(waiter)
+            if skill and (result == -1 or 'OVF' in result[1]):
+                ardSerial.forgetSkill(port)
+            self.reply({'op': 'result', 'id': id, 'index': index, 'result': result})
+        with self.requestsLock:
+            self.requests.pop(id, None)
+
+    def cancelRequest(self, id):
+        # the client gave up, so the echoes still expected must not be taken from the next requests
+        with self.requestsLock:
+            request = self.requests.pop(id, None)
+        if request is not None:
+            port, waiters, skill = request
+            if skill:
+                ardSerial.forgetSkill(port)
+            for waiter in waiters:
+                port.reader.cancel(waiter)
+                waiter.fail()
+
+    def subscribe(self):
+        # the subscribers run in the ports' reader threads, so they only queue the lines
+        # and a slow client never holds up the reading of a port
+        if self.lines is None:
+            self.lines = queue.Queue(lineQueueSize)
+            threading.Thread(target=self.forwardLines, daemon=True).start()
+        for port in list(self.server.ports):
+            reader = port.Start_Reader()
+            name = self.server.ports.get(port)
+
+            def forward(line, name=name):
+                if not self.open:
+                    return
+                try:
+                    self.lines.put_nowait({'op': 'line', 'port': name, 'line': line})
+                except queue.Full:
+                    if not self.dropped:
+                        logger.info("A broker client doesn't keep up, dropping its unsolicited lines")
+                    self.dropped += 1
+            reader.addSubscriber(forward)
+            self.subscriptions.append([reader, forward])
+
+    def forwardLines(self):
+        while self.open:
+            message = self.lines.get()
+            if message is None:
+                break
+            self.reply(message)
+
+    def finish(self):
+        self.open = False
+        for reader, forward in self.subscriptions:
+            reader.removeSubscriber(forward)
+        if self.lines is not None:
+            try:
+                self.lines.put_nowait(None)    # wakes up forwardLines
+            except queue.Full:
+                pass    # it is blocked in a write, which fails once the connection is closed
+        with self.requestsLock:
+            ids = list(self.requests)
+        for id in ids:
+            self.cancelRequest(id)
+        socketserver.StreamRequestHandler.finish(self)
+
+
+class SerialBroker(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, ports, path=defaultSocket):
+        self.ports = ports    # {port object: name}, kept up to date by keepCheckingPort
+        self.path = path
+        if os.path.exists(path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(path)
+                raise OSError('A broker is already running on ' + path)
+            except ConnectionError:
+                os.unlink(path)    # left by a broker that didn't exit cleanly
+            finally:
+                probe.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        socketserver.UnixStreamServer.__init__(self, path, BrokerSession)
+        os.chmod(path, 0o600)
+
+    def portByName(self, name):
+        for port, portName in list(self.ports.items()):
+            if portName == name:
+                return port
+        return None
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Share the serial ports of the robots between the tools')
+    parser.add_argument('--port', action='append', help='serial port to open, may be repeated. default: connectPort()')
+    parser.add_argument('--socket', default=defaultSocket)
+    args = parser.parse_args()
+
+    startLogging()
+    ports = ardSerial.goodPorts
+    if args.port:
+        for device in args.port:
+            serialObject = Communication(device, 115200, 1)
+            if serialObject.main_engine is not None:
+                ports[serialObject] = device.split('/')[-1]
+                ardSerial.getModelAndVersion(ardSerial.sendTask(ports, serialObject, ['?', 0], 2), serialObject)
+    else:
+        connectPort(ports)
+    if not ports:
+        sys.exit('No robot is connected')
+    threading.Thread(target=keepCheckingPort, args=(ports, lambda: True), daemon=True).start()
+    broker = SerialBroker(ports, args.socket)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))    # still remove the socket
+    print('Serial broker of {} on {}'.format(', '.join(ports.values()), args.socket), flush=True)
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        broker.server_close()
+        ardSerial.closeAllSerial(ports, False)
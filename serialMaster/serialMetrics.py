@@ -0,0 +1,181 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Per-port statistics of the serial links: commands per token, bytes in and out, echo latency, timeouts,
+# reconnects, bytes discarded from a previous response, and the number of requests waiting for an echo.
+# The counters of a port are plain attributes and preallocated lists, so counting a command allocates
+# nothing and takes no lock (the GIL keeps the increments of one thread consistent).
+#   startMetricsServer(9108)    # Prometheus text format on http://127.0.0.1:9108/metrics
+#   getStats()    # {port name: {...}}
+
+import bisect
+import threading
+import weakref
+
+latencyBuckets = (0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10)    # seconds
+
+
+class Histogram(object):
+    def __init__(self, buckets=latencyBuckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)    # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        result = list()
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+
+class PortMetrics(object):
+    """
+    Counters of one serial port
+    """
+    def __init__(self, name):
+        self.name = name
+        self.commands = [0] * 256    # indexed by the token byte
+        self.bytesOut = 0
+        self.bytesIn = 0
+        self.timeouts = 0
+        self.connects = 0
+        self.discardedBytes = 0
+        self.latency = Histogram()
+        self.communication = None    # weak reference to the port object, for the queue depth
+
+    def sent(self, data):
+        if data:
+            self.commands[data[0] if not isinstance(data, str) else ord(data[0]) & 0xff] += 1
+            self.bytesOut += len(data)
+
+    def attach(self, communication):
+        self.communication = weakref.ref(communication)
+        self.connects += 1
+
+    def queueDepth(self):
+        communication = self.communication() if self.communication is not None else None
+        reader = getattr(communication, 'reader', None)
+        return len(reader.waiters) if reader is not None else 0
+
+    def stats(self):
+        return {
+            'commands': {chr(t): n for t, n in enumerate(self.commands) if n},
+            'bytesOut': self.bytesOut,
+            'bytesIn': self.bytesIn,
+            'timeouts': self.timeouts,
+            'reconnects': max(0, self.connects - 1),
+            'discardedBytes': self.discardedBytes,
+            'queueDepth': self.queueDepth(),
+            'latency': {'count': self.latency.count, 'sum': self.latency.sum,
+                        'buckets': self.latency.cumulative()},
+        }
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self.ports = {}
+        self.lock = threading.Lock()    # only taken when a port is seen for the first time
+
+    def port(self, name):
+        metrics = self.ports.get(name)
+        if metrics is None:
+            with self.lock:
+                metrics = self.ports.get(name)
+                if metrics is None:
+                    metrics = self.ports[name] = PortMetrics(name)
+        return metrics
+
+    def getStats(self):
+        return {name: metrics.stats() for name, metrics in list(self.ports.items())}
+
+    def prometheusText(self):
+        lines = list()
+
+        def family(name, kind, help, samples):
+            lines.append('# HELP opencat_serial_{} {}'.format(name, help))
+            lines.append('# TYPE opencat_serial_{} {}'.format(name, kind))
+            for labels, value in samples:
+                lines.append('opencat_serial_{}{{{}}} {}'.format(
+                    name, ','.join('{}="{}"'.format(k, escape(v)) for k, v in labels), value))
+
+        ports = list(self.ports.values())
+        family('commands_total', 'counter', 'Commands written, by token',
+               [((('port', m.name), ('token', chr(t))), n) for m in ports for t, n in enumerate(m.commands) if n])
+        family('bytes_out_total', 'counter', 'Bytes written', [((('port', m.name),), m.bytesOut) for m in ports])
+        family('bytes_in_total', 'counter', 'Bytes received', [((('port', m.name),), m.bytesIn) for m in ports])
+        family('timeouts_total', 'counter', 'Requests without an echo before the deadline',
+               [((('port', m.name),), m.timeouts) for m in ports])
+        family('reconnects_total', 'counter', 'Times the port was opened again',
+               [((('port', m.name),), max(0, m.connects - 1)) for m in ports])
+        family('discarded_bytes_total', 'counter', 'Unread bytes of previous responses dropped before a request',
+               [((('port', m.name),), m.discardedBytes) for m in ports])
+        family('queue_depth', 'gauge', 'Requests waiting for their echo',
+               [((('port', m.name),), m.queueDepth()) for m in ports])
+        lines.append('# HELP opencat_serial_echo_latency_seconds Time from a request to its echo')
+        lines.append('# TYPE opencat_serial_echo_latency_seconds histogram')
+        for m in ports:
+            port = escape(m.name)
+            for bound, count in m.latency.cumulative():
+                lines.append('opencat_serial_echo_latency_seconds_bucket{{port="{}",le="{}"}} {}'.format(
+                    port, '+Inf' if bound == float('inf') else bound, count))
+            lines.append('opencat_serial_echo_latency_seconds_sum{{port="{}"}} {}'.format(port, m.latency.sum))
+            lines.append('opencat_serial_echo_latency_seconds_count{{port="{}"}} {}'.format(port, m.latency.count))
+        return '\n'.join(lines) + '\n'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+metrics = MetricsRegistry()
+
+
+def getStats():
+    """
+    the statistics of all the ports as a dictionary {port name: {...}}
+    """
+    return metrics.getStats()
+
+
+get_stats = getStats
+
+
+def startMetricsServer(port=9108, host='127.0.0.1'):
+    """
+    serve the metrics in the Prometheus text format from a background thread, returns the server
+    """
+    # http.server is only loaded by the programs that serve the metrics
+    try:
+        from http.server import ThreadingHTTPServer as MetricsHTTPServer
+    except ImportError:    # Python < 3.7
+        from http.server import HTTPServer as MetricsHTTPServer
+    from http.server import BaseHTTPRequestHandler
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/', '/metrics'):
+                self.send_error(404)
+                return
+            body = metrics.prometheusText().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):    # no line on stderr for every scrape
+            pass
+
+    server = MetricsHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,277 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Record and replay of serial sessions, for profiling the host scripts offline and deterministically.
+# The recorder appends every write and every read of the ports to a session file:
+#   python3 serialSession.py record session.ocs testSkills.py [arguments of the script]
+# or in Python: startRecording('session.ocs') ... stopRecording()
+# The replayer serves a recorded port on a pseudo-terminal, like virtualRobot.py does. It waits for each
+# recorded write of the host and then sends the recorded reads with their recorded delays, divided by speed:
+#   python3 serialSession.py replay session.ocs [--port ttyUSB0] [--speed 2]
+#   python3 serialSession.py info session.ocs
+#
+# File format: sessionMagic, then records of sessionRecord (seconds since the start, kind, port index, length)
+# each followed by its bytes. A PORT record gives the name of the next port index. The file is only appended to,
+# a record cut by a crash is ignored, and loadSession() maps it with mmap instead of reading it.
+
+import atexit
+import mmap
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+WRITE = 0
+READ = 1
+PORT = 2
+kindNames = ('write', 'read', 'port')
+sessionMagic = b'OCSESS1\n'
+sessionRecord = struct.Struct('<dBBI')    # seconds, kind, port index, number of bytes that follow
+drainSeconds = 5    # the replayer waits so long for the host to read the last replies
+
+
+class SessionRecorder(object):
+    """
+    Appends the traffic of all the ports to a session file while active
+    """
+    def __init__(self):
+        self.active = False
+        self.file = None
+        self.ports = {}    # name: index
+        self.start = 0
+        self.lock = threading.Lock()
+
+    def open(self, path):
+        self.close()
+        with self.lock:
+            self.file = open(path, 'wb')
+            self.file.write(sessionMagic)
+            self.ports = {}
+            self.start = time.perf_counter()
+            self.active = True
+
+    def record(self, kind, port, data):
+        now = time.perf_counter() - self.start
+        with self.lock:
+            if self.file is None or not data:
+                return
+            index = self.ports.get(port)
+            if index is None:
+                index = self.ports[port] = len(self.ports)
+                name = str(port).encode()
+                self.file.write(sessionRecord.pack(now, PORT, index, len(name)) + name)
+            if isinstance(data, str):
+                data = data.encode('ISO-8859-1')
+            self.file.write(sessionRecord.pack(now, kind, index, len(data)))
+            self.file.write(data)
+
+    def write(self, port, data):
+        self.record(WRITE, port, data)
+
+    def read(self, port, data):
+        self.record(READ, port, data)
+
+    def close(self):
+        self.active = False
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+recorder = SessionRecorder()
+
+
+def startRecording(path):
+    recorder.open(path)
+    atexit.register(stopRecording)
+
+
+def stopRecording():
+    recorder.close()
+
+
+class Session(object):
+    """
+    A session file mapped in memory
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if f.read(len(sessionMagic)) != sessionMagic:
+                raise ValueError(path + ' is not a session file')
+            size = os.fstat(f.fileno()).st_size
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size > len(sessionMagic) else b''
+        self.ports = list()
+        for stamp, kind, port, data in self.records():
+            if kind == PORT:
+                self.ports.append(bytes(data).decode())
+
+    def records(self):
+        """
+        (seconds, kind, port index, memoryview of the bytes) of every complete record
+        """
+        view = memoryview(self.data)
+        offset = len(sessionMagic)
+        while offset + sessionRecord.size <= len(view):
+            stamp, kind, port, length = sessionRecord.unpack_from(view, offset)
+            offset += sessionRecord.size
+            if offset + length > len(view):
+                break
+            yield stamp, kind, port, view[offset:offset + length]
+            offset += length
+
+    def events(self, port):
+        """
+        [seconds, kind, bytes] of the writes and reads of a port
+        """
+        index = self.ports.index(port)
+        return [[stamp, kind, bytes(data)] for stamp, kind, p, data in self.records() if p == index and kind != PORT]
+
+    def summary(self):
+        result = {name: {'writes': 0, 'reads': 0, 'bytesOut': 0, 'bytesIn': 0, 'seconds': 0} for name in self.ports}
+        for stamp, kind, port, data in self.records():
+            if kind == PORT:
+                continue
+            stats = result[self.ports[port]]
+            stats['writes' if kind == WRITE else 'reads'] += 1
+            stats['bytesOut' if kind == WRITE else 'bytesIn'] += len(data)
+            stats['seconds'] = stamp
+        return result
+
+
+def loadSession(path):
+    return Session(path)
+
+
+class SessionReplayer(object):
+    """
+    Serves the recorded traffic of one port on a pseudo-terminal.
+    The reads that followed a write are timed from the moment the host writes the same command,
+    so the host's own delays don't shift the replies. speed 0 sends them without waiting.
+    """
+    def __init__(self, path, port=None, speed=1.0):
+        session = loadSession(path)
+        if not session.ports:
+            raise ValueError(path + ' has no recorded port')
+        self.port = port if port is not None else session.ports[0]
+        self.events = session.events(self.port)
+        self.speed = speed
+        self.mismatches = 0    # writes of the host that differ from the recorded ones
+        self.received = bytearray()
+        self.master = None
+        self.slave = None
+        self.name = None
+        self.running = False
+        self.finished = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        open the pseudo-terminal and return the name of the port to open
+        """
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.name = os.ttyname(self.slave)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.name
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1)
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    def waitForWrite(self, expected):
+        while self.running and len(self.received) < len(expected):
+            try:
+                if select.select([self.master], [], [], 0.1)[0]:
+                    self.received += os.read(self.master, 4096)
+            except (OSError, ValueError):
+                self.running = False
+        if self.received[:len(expected)] != expected:
+            self.mismatches += 1
+        del self.received[:len(expected)]
+
+    def run(self):
+        origin = time.perf_counter()    # when the recorded time 0 is replayed
+        for stamp, kind, data in self.events:
+            if not self.running:
+                break
+            if kind == WRITE:
+                self.waitForWrite(data)
+                origin = time.perf_counter() - (stamp / self.speed if self.speed > 0 else 0)
+            else:
+                if self.speed > 0:
+                    wait = origin + stamp / self.speed - time.perf_counter()
+                    if wait > 0:
+                        time.sleep(wait)
+                try:
+                    os.write(self.master, data)
+                except OSError:
+                    break
+        deadline = time.perf_counter() + drainSeconds
+        while self.running and self.unread() and time.perf_counter() < deadline:
+            time.sleep(0.01)    # closing the pseudo-terminal would drop the replies the host hasn't read
+        self.finished.set()
+
+    def unread(self):
+        import fcntl
+        import termios
+        try:
+            return struct.unpack('i', fcntl.ioctl(self.slave, termios.FIONREAD, b'\0' * 4))[0]
+        except (OSError, TypeError):
+            return 0
+
+
+def recordScript(path, script, arguments):
+    import runpy
+    import serialSession    # the recorder of the module that SerialCommunication imports, not of __main__
+    sys.argv = [script] + arguments
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    serialSession.startRecording(path)
+    try:
+        runpy.run_path(script, run_name='__main__')
+    finally:
+        serialSession.stopRecording()
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description='Record and replay serial sessions')
+    commands = parser.add_subparsers(dest='command')
+    record = commands.add_parser('record', help='run a host script and record its serial traffic')
+    record.add_argument('session')
+    record.add_argument('script')
+    record.add_argument('arguments', nargs=argparse.REMAINDER)
+    replay = commands.add_parser('replay', help='serve a recorded port on a pseudo-terminal')
+    replay.add_argument('session')
+    replay.add_argument('--port', help='recorded port name, default: the first one')
+    replay.add_argument('--speed', type=float, default=1.0, help='playback speed, 0 replies without waiting')
+    info = commands.add_parser('info', help='print the ports and the traffic of a session as JSON')
+    info.add_argument('session')
+    args = parser.parse_args()
+
+    if args.command == 'record':
+        recordScript(args.session, args.script, args.arguments)
+    elif args.command == 'replay':
+        replayer = SessionReplayer(args.session, args.port, args.speed)
+        print('Replaying {} of {} on {}'.format(replayer.port, args.session, replayer.start()), flush=True)
+        try:
+            replayer.finished.wait()
+        except KeyboardInterrupt:
+            pass
+        replayer.stop()
+        print('Mismatched writes: {}'.format(replayer.mismatches))
+    elif args.command == 'info':
+        print(json.dumps(loadSession(args.session).summary(), indent=1))
+    else:
+        parser.print_help()
@@ -0,0 +1,121 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Tracing of the serial traffic, cheap enough to stay on in the hot path.
+# Every write and every completed request is appended as a tuple to an in-memory ring buffer,
+# nothing is formatted until the buffer is dumped:
+#   tracer.dump('trace.bin')    # or tracer.dumpCsv('trace.csv')
+#   for event in loadTrace('trace.bin'): ...
+# startFileLogging() sends the log records through a queue to a background thread that writes the file,
+# so logging an INFO message doesn't wait for the disk.
+
+import atexit
+import collections
+import json
+import logging
+import queue
+import struct
+import time
+
+SEND = 0
+RECEIVE = 1
+kindNames = ('send', 'recv')
+traceMagic = b'OCTRACE1\n'
+traceRecord = struct.Struct('<dBBcIf')    # time, kind, port index, token, bytes, latency in seconds
+fileListener = None
+
+
+class Tracer(object):
+    """
+    Ring buffer of the send and receive events of all the ports
+    """
+    def __init__(self, capacity=4096, enabled=True):
+        self.events = collections.deque(maxlen=capacity)    # (time, kind, port, token, bytes, latency)
+        self.enabled = enabled
+
+    def send(self, port, data):
+        if self.enabled:
+            self.events.append((time.time(), SEND, port, bytes(data[:1]), len(data), 0.0))
+
+    def receive(self, port, token, size, latency):
+        if self.enabled:
+            self.events.append((time.time(), RECEIVE, port, token, size, latency))
+
+    def snapshot(self):
+        return list(self.events)
+
+    def clear(self):
+        self.events.clear()
+
+    def dump(self, path):
+        """
+        write the events to a binary file: a header with the port names, then fixed size records
+        """
+        events = self.snapshot()
+        ports = sorted(set(str(e[2]) for e in events))
+        index = {name: i for i, name in enumerate(ports)}
+        with open(path, 'wb') as f:
+            f.write(traceMagic)
+            f.write(json.dumps(ports).encode() + b'\n')
+            for stamp, kind, port, token, size, latency in events:
+                f.write(traceRecord.pack(stamp, kind, index[str(port)], token[:1] or b'\0', size, latency))
+        return len(events)
+
+    def dumpCsv(self, path):
+        import csv
+        events = self.snapshot()
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['time', 'kind', 'port', 'token', 'bytes', 'latency'])
+            for stamp, kind, port, token, size, latency in events:
+                writer.writerow(['%.6f' % stamp, kindNames[kind], port, token.decode('ISO-8859-1'), size,
+                                 '%.6f' % latency])
+        return len(events)
+
+
+def loadTrace(path):
+    """
+    read a binary trace, returns a list of (time, kind name, port, token, bytes, latency)
+    """
+    with open(path, 'rb') as f:
+        if f.readline() != traceMagic:
+            raise ValueError(path + ' is not a trace file')
+        ports = json.loads(f.readline().decode())
+        data = f.read()
+    events = list()
+    for stamp, kind, port, token, size, latency in traceRecord.iter_unpack(data[:len(data) - len(data) % traceRecord.size]):
+        events.append((stamp, kindNames[kind], ports[port], token.decode('ISO-8859-1'), size, latency))
+    return events
+
+
+tracer = Tracer()
+
+
+def startFileLogging(path, level=logging.INFO, format=None, mode='a+'):
+    """
+    like logging.basicConfig(filename=path), but the file is written by a background thread
+    """
+    global fileListener
+    import logging.handlers
+    root = logging.getLogger()
+    if root.handlers:    # already configured, as basicConfig() would do nothing
+        return None
+    records = queue.SimpleQueue() if hasattr(queue, 'SimpleQueue') else queue.Queue()
+    handler = logging.FileHandler(path, mode)
+    handler.setFormatter(logging.Formatter(format))
+    fileListener = logging.handlers.QueueListener(records, handler)
+    fileListener.start()
+    root.addHandler(logging.handlers.QueueHandler(records))
+    root.setLevel(level)
+    atexit.register(stopFileLogging)
+    return fileListener
+
+
+def stopFileLogging():
+    # writes the records still in the queue
+    global fileListener
+    if fileListener is not None:
+        listener, fileListener = fileListener, None
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
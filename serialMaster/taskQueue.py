@@ -0,0 +1,179 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Compiles a schedule of tasks ([token, var, delay] as taken by ardSerial.send()) into the firmware's task queue command:
+#   q token1 parameters1:delay1>token2 parameters2:delay2> ...
+# e.g. "qksit:1000>m0 45 0 -45:500>kbalance\n". The firmware runs the tasks with its own timer and echoes each token,
+# so a batch costs one upload instead of a round trip and a host sleep per task.
+# The queue only takes ASCII commands. I, M, B and L are converted to i, m and b; the other binary tokens (K, C, W, R, T ...)
+# are sent on their own between the batches, or rejected with strict=True.
+# A board built without TASK_QUEUE only echoes 'q', in that case every task is sent on its own.
+#   sendSchedule(goodPorts, [['ksit', 1], ['m', [0, 45, 0, -45], 0.5], ['kbalance', 0]])
+
+import copy
+import threading
+import time
+from ardSerial import sendTask, splitTaskForLargeAngles, acceptedResponses, responseTimeout, goodPorts, logger
+
+maxBatchBytes = 96    # every queued task is copied to the heap, the NyBoard only has 2 KB of RAM
+maxBatchTasks = 8
+maxTaskDelay = 32767    # ms, the delay of a Task is an int, 16 bits on the NyBoard
+reservedCharacters = '>:\n~'
+supportCache = {}    # {SerialPort Object: whether the firmware runs the 'q' command}
+
+
+def queueTask(task):
+    """
+    ASCII text of a task in the queue, without its delay. ValueError if the queue cannot hold it
+    """
+    if len(task) == 2 or isinstance(task[1][0], str):
+        var = [task[0]] if len(task) == 2 else list(task[1])
+        token = var[0][0]
+        if token in 'LI':    # the string form of the binary joint commands, see encodeByte()
+            numbers = [int(v) for v in ([var[0][1:]] if len(var[0]) > 1 else []) + var[1:]]
+            return queueTask([token, numbers, 0])
+        if token in 'cmibut' and len(var) >= 2:
+            text = ' '.join(var)
+        elif token in 'wkX':
+            text = var[0]
+        else:
+            text = token
+    else:
+        token = task[0]
+        numbers = [int(round(v)) for v in task[1]]
+        if token == 'L':
+            numbers = [n for pair in enumerate(numbers) for n in pair]
+            token = 'i'
+        elif token == 'B':
+            numbers = [n * 8 if i % 2 else n for i, n in enumerate(numbers)]    # as packetEncoder encodes B
+            token = 'b'
+        elif token in 'IM':
+            token = token.lower()
+        text = token + ' '.join(str(n) for n in numbers)
+    token = text[0]
+    if not ('a' <= token <= 'z' or token == '?') or token == 'q':
+        raise ValueError('the task queue cannot hold the token ' + token)
+    if any(c in reservedCharacters for c in text):
+        raise ValueError('the parameters of ' + token + ' contain a separator of the task queue')
+    return text
+
+
+def compileSchedule(schedule, maxBytes=maxBatchBytes, maxTasks=maxBatchTasks, strict=False):
+    """
+    split a schedule into segments, in the order of the schedule:
+        ['q', payload bytes, [indices of the tasks]] for a batch of the task queue
+        ['send', index] for a task that is sent on its own
+    """
+    segments = list()
+    batch = list()    # [index, text with delay]
+
+    def flush():
+        if batch:
+            payload = ('q' + '>'.join(entry for index, entry in batch) + '\n').encode()
+            segments.append(['q', payload, [index for index, entry in batch]])
+            del batch[:]
+
+    for index, task in enumerate(schedule):
+        try:
+            text = queueTask(task)
+        except ValueError:
+            if strict:
+                raise
+            flush()
+            segments.append(['send', index])
+            continue
+        delay = int(round(task[-1] * 1000)) if len(task) > 1 else 0
+        entry = text + (':' + str(delay) if delay else '')
+        if len(entry) + 2 > maxBytes or not 0 <= delay <= maxTaskDelay:
+            if strict:
+                raise ValueError('the task ' + str(index) + ' is longer than a batch')
+            flush()
+            segments.append(['send', index])
+            continue
+        if len(batch) >= maxTasks or 2 + sum(len(e) + 1 for i, e in batch) + len(entry) > maxBytes:
+            flush()
+        batch.append([index, entry])
+    flush()
+    return segments
+
+
+def supportsTaskQueue(port):
+    # a queued '?' prints the model only if the firmware runs the queue
+    if port not in supportCache:
+        reader = port.Start_Reader()
+        with port.requestLock:
+            reader.flush()
+            echo = reader.expect(('q',))
+            query = reader.expect(('?',))
+            port.Send_data(b'q?\n')
+        supported = echo.result(1) != -1 and query.result(0.5) != -1
+        if not supported:
+            reader.cancel(echo)
+            reader.cancel(query)
+        supportCache[port] = supported
+    return supportCache[port]
+
+
+def sendBatch(port, schedule, indices, payload, results):
+    reader = port.Start_Reader()
+    tokens = [queueTask(schedule[i])[0] for i in indices]
+    with port.requestLock:
+        waiters = [reader.expect(('q',))] + [reader.expect(acceptedResponses(t)) for t in tokens]
+        port.Send_data(payload)
+    previousDelay = 0
+    for w, waiter in enumerate(waiters):
+        token = 'q' if w == 0 else tokens[w - 1]
+        result = waiter.result(responseTimeout(token) + previousDelay)
+        if result == -1:
+            for remaining in waiters[w:]:
+                reader.cancel(remaining)
+            if w > 0:
+                results[indices[w - 1]] = -1
+            return False
+        if w > 0:
+            results[indices[w - 1]] = result
+            previousDelay = schedule[indices[w - 1]][-1] if len(schedule[indices[w - 1]]) > 1 else 0
+    time.sleep(previousDelay)    # the board doesn't read the port before the delay of the last task
+    return True
+
+
+def sendScheduleToPort(PortList, port, schedule, maxBytes=maxBatchBytes, maxTasks=maxBatchTasks, strict=False):
+    # returns the results of the tasks like sendTaskPipeline(): the echo, -1 for a failed task, None if not sent
+    results = [None] * len(schedule)
+    if not supportsTaskQueue(port):
+        logger.info("The firmware has no task queue, sending the tasks one by one")
+        segments = [['send', index] for index in range(len(schedule))]
+    else:
+        segments = compileSchedule(schedule, maxBytes, maxTasks, strict)
+    for segment in segments:
+        if segment[0] == 'q':
+            if not sendBatch(port, schedule, segment[2], segment[1], results):
+                return results
+        else:
+            index = segment[1]
+            for part in splitTaskForLargeAngles(copy.deepcopy(schedule[index])):
+                results[index] = sendTask(PortList, port, part)
+            if results[index] == -1:
+                return results
+    return results
+
+
+def sendSchedule(ports, schedule, maxBytes=maxBatchBytes, maxTasks=maxBatchTasks, strict=False):
+    """
+    run a schedule through the task queue, with several ports returns {port object: list of results}
+    """
+    PortList = ports if isinstance(ports, dict) else goodPorts
+    p = list(ports.keys()) if isinstance(ports, dict) else list(ports)
+    if len(p) == 1:
+        return sendScheduleToPort(PortList, p[0], schedule, maxBytes, maxTasks, strict)
+    results = {}
+    threads = list()
+    for serialObject in p:
+        t = threading.Thread(target=lambda s: results.update({s: sendScheduleToPort(PortList, s, schedule, maxBytes, maxTasks, strict)}),
+                             args=(serialObject,))
+        threads.append(t)
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join()
+    return results
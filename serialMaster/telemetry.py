@@ -0,0 +1,260 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# Joint angle telemetry.
+# A background thread polls the 'j' table at a fixed rate and keeps the angles in a preallocated
+# (capacity, 16) int16 ring buffer with the host timestamps, so control code and UIs can read
+# the joint state without a round trip to the robot:
+#   telemetry = JointTelemetry(serialObject, rate=20).start()
+#   stamp, angles = telemetry.latest()
+#   stamps, history = telemetry.window(2.0)    # the last two seconds
+#
+# IMU capture.
+# The verbose gyro prints toggled by 'V' are taken out of the received lines before they reach the command
+# responses, parsed from the receive buffer into a float32 ring buffer, and optionally recorded to a binary file:
+#   imu = ImuCapture(serialObject).start(record='imu.bin')
+#   stamps, samples = imu.window(1.0)    # pitch, roll, accX, accY, accZ
+#   imu.stop()
+#   stamps, samples = loadImuRecording('imu.bin')
+
+import struct
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DOF = 16
+separator = b',\t'    # the firmware's printList() ends every angle with ",\t"
+imuFields = 5    # print6Axis(): pitch, roll, and the accelerations x, y, z if READ_ACCELERATION is defined
+imuRecord = struct.Struct('<d5f')    # host timestamp and the fields, NaN for the missing ones
+
+
+def parseAngleRow(line, out):
+    """
+    parse a row of the j table, such as b"0,\t-3,\t...,\t\r", into out (16 int16).
+    the numbers are read from the bytes, returns False if the line is not a full row.
+    """
+    row = line.split(separator)
+    if len(row) != DOF + 1 or row[-1].strip():
+        return False
+    try:
+        for joint in range(DOF):
+            out[joint] = int(row[joint])
+    except (ValueError, OverflowError):
+        return False
+    return True
+
+
+class JointTelemetry(object):
+    """
+    Polls the joint angles of one port in the background
+    """
+    def __init__(self, port, rate=20, capacity=1024, timeout=0.5):
+        if np is None:
+            raise ImportError('JointTelemetry needs NumPy')
+        self.port = port
+        self.period = 1.0 / rate
+        self.timeout = timeout
+        self.angles = np.zeros((capacity, DOF), dtype=np.int16)
+        self.stamps = np.zeros(capacity, dtype=np.float64)
+        self.count = 0    # number of samples written, the next slot is count % capacity
+        self.lock = threading.Lock()
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        if self.thread is None or not self.thread.is_alive():
+            self.running = True
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(self.timeout + self.period)
+
+    def run(self):
+        next = time.perf_counter()
+        while self.running:
+            self.poll()
+            next += self.period
+            wait = next - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            else:
+                next = time.perf_counter()    # fell behind, don't try to catch up
+
+    def poll(self):
+        """
+        read the angles once, returns False if the port is busy or doesn't answer
+        """
+        reader = self.port.Start_Reader()
+        with self.port.requestLock:
+            if reader.waiters:    # don't interleave with a command that is still running, e.g. a behavior
+                return False
+            waiter = reader.expect(('j',))
+            sent = time.time()
+            self.port.Send_data(b'j\n')
+        result = waiter.result(self.timeout)
+        if result == -1:
+            reader.cancel(waiter)
+            return False
+        stamp = (sent + time.time()) / 2    # the table was printed around the middle of the round trip
+        with self.lock:
+            slot = self.count % len(self.stamps)
+            for line in reversed(waiter.prints.split(b'\n')):
+                if parseAngleRow(line, self.angles[slot]):
+                    self.stamps[slot] = stamp
+                    self.count += 1
+                    return True
+        return False
+
+    def latest(self):
+        """
+        the last sample as (timestamp, int16 angles), or None before the first one
+        """
+        with self.lock:
+            if not self.count:
+                return None
+            slot = (self.count - 1) % len(self.stamps)
+            return self.stamps[slot], self.angles[slot].copy()
+
+    def window(self, seconds):
+        """
+        the samples of the last seconds in time order, as (timestamps, (n, 16) int16 angles)
+        """
+        since = time.time() - seconds
+        with self.lock:
+            n = min(self.count, len(self.stamps))
+            slots = np.arange(self.count - n, self.count) % len(self.stamps)
+            stamps = self.stamps[slots]
+            recent = stamps >= since
+            return stamps[recent], self.angles[slots[recent]]
+
+
+def parseImuLine(line, out):
+    """
+    parse a gyro print, such as b"1.23456\t-0.54321\t12\t-3\t8190\r\n", into out (5 float32).
+    line is any bytes-like object, the fields are converted without copying it. returns False for the other lines.
+    """
+    chars = np.frombuffer(line, dtype=np.uint8)
+    tabs = np.flatnonzero(chars == 9)    # '\t'
+    if len(tabs) != 1 and len(tabs) != imuFields - 1:
+        return False
+    if not (chars == 46).any() or (chars == 44).any():    # a float has a '.', the tables have ','
+        return False
+    start = 0
+    try:
+        for field, end in enumerate(tabs.tolist() + [len(line)]):
+            out[field] = float(line[start:end])
+            start = end + 1
+    except ValueError:
+        return False
+    out[len(tabs) + 1:] = np.nan
+    return True
+
+
+class ImuCapture(object):
+    """
+    Captures the verbose gyro prints of one port
+    """
+    def __init__(self, port, capacity=4096, timeout=1):
+        if np is None:
+            raise ImportError('ImuCapture needs NumPy')
+        self.port = port
+        self.timeout = timeout
+        self.samples = np.zeros((capacity, imuFields), dtype=np.float32)
+        self.stamps = np.zeros(capacity, dtype=np.float64)
+        self.count = 0
+        self.lock = threading.Lock()
+        self.file = None
+
+    def toggle(self, on):
+        # 'V' toggles the verbose prints, the echo tells the new state
+        reader = self.port.Start_Reader()
+        for attempt in range(2):
+            with self.port.requestLock:
+                waiter = reader.expect(('v',))
+                self.port.Send_data(b'V\n')
+            result = waiter.result(self.timeout)
+            if result == -1:
+                reader.cancel(waiter)
+                return False
+            if result[0].startswith('V') == on:
+                return True
+        return False
+
+    def start(self, record=None):
+        """
+        turn on the verbose gyro prints and capture them, also append them to the record file if given
+        """
+        if record is not None:
+            self.file = open(record, 'ab')
+        self.port.Start_Reader().addListener(self.onLine)
+        if not self.toggle(True):
+            self.stop()
+            raise IOError('the robot does not print the gyro data')
+        return self
+
+    def stop(self):
+        self.toggle(False)
+        if self.port.reader is not None:
+            self.port.reader.removeListener(self.onLine)
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def onLine(self, line):
+        # called by the reader thread for every line
+        with self.lock:
+            slot = self.count % len(self.stamps)
+            sample = self.samples[slot]
+            if not parseImuLine(line, sample):
+                return False
+            stamp = self.stamps[slot] = time.time()
+            self.count += 1
+            if self.file is not None:
+                self.file.write(imuRecord.pack(stamp, *sample))
+        return True
+
+    def latest(self):
+        """
+        the last sample as (timestamp, float32 [pitch, roll, accX, accY, accZ]), or None
+        """
+        with self.lock:
+            if not self.count:
+                return None
+            slot = (self.count - 1) % len(self.stamps)
+            return self.stamps[slot], self.samples[slot].copy()
+
+    def window(self, seconds):
+        """
+        the samples of the last seconds in time order, as (timestamps, (n, 5) float32)
+        """
+        since = time.time() - seconds
+        with self.lock:
+            n = min(self.count, len(self.stamps))
+            slots = np.arange(self.count - n, self.count) % len(self.stamps)
+            stamps = self.stamps[slots]
+            recent = stamps >= since
+            return stamps[recent], self.samples[slots[recent]]
+
+    def save(self, path, seconds=None):
+        """
+        save the buffered samples, or those of the last seconds, to a NumPy .npz file
+        """
+        stamps, samples = self.window(float('inf') if seconds is None else seconds)
+        np.savez(path, stamps=stamps, samples=samples)
+
+
+def loadImuRecording(path):
+    """
+    read a file recorded by ImuCapture.start(record=path), returns (timestamps, (n, 5) float32)
+    """
+    records = np.fromfile(path, dtype=np.dtype([('stamp', '<f8'), ('samples', '<f4', (imuFields,))]))
+    return records['stamp'], records['samples']
@@ -4,6 +4,7 @@
 import sys
 sys.path.append("..")
 from ardSerial import *
+from taskQueue import sendSchedule
 # the following skill arrays are identical to those in InstinctBittle.h
 skillNames =["pickUpL","dropDownL","huntL","showOffL","putAwayL","throwAwayL","shootL","bdF","bk","bkArmF","bkArmLF","bkF","bkL","crArmF","crArmL","crF","crL","gpF","gpL","hlw","jpF","lftF","lftL","phF","phL","trArmF","trArmL","trF","trL","vtArmF","vtF","vtL","wkArmF","wkArmL","wkF","wkL","balance","buttUp","calib","dropped","lifted","lnd","rest","sit","str","up","zeroN","ang","bf","bx","chr","ck","clap","cmh","dg","ff","fiv","gdb","hds","hg","hi","hsk","hu","jmp","kc","knock","lpov","mw","nd","pd","pee","pu","pu1","rc","rl","scrh","snf","tbl","ts","wh","zz"]
 
@@ -33,10 +34,8 @@ if __name__ == '__main__':
         parallel = False
 #        if len(goodPorts)>0:
 #        time.sleep(2);
-        for task in skillNames:  # execute the tasks in the testSchedule
-            print(['k'+task,1])
-            send(goodPorts, ['k'+task,1])
-        send(goodPorts, ['kbalance',0.5])
+        print(skillNames)
+        sendSchedule(goodPorts, [['k'+task,1] for task in skillNames] + [['kbalance',0.5]])  # the board runs the skills from its task queue
 
 # the following test checks the serial pass through mode
 #        send(goodPorts,['kup',1])
@@ -0,0 +1,43 @@
+# Tests of the host side against the virtual robot of virtualRobot.py, no robot needed:
+#   cd serialMaster && python3 -m pytest tests
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import brokerClient
+
+brokerClient.enabled = False    # the tests open the emulated ports directly, even if a broker is running
+
+from SerialCommunication import Communication
+from virtualRobot import VirtualRobot
+
+
+@pytest.fixture
+def robot():
+    robot = VirtualRobot()
+    robot.start()
+    yield robot
+    robot.stop()
+
+
+@pytest.fixture
+def port(robot):
+    port = Communication(robot.name, 115200, 1)
+    yield port
+    port.Close_Engine()
+
+
+@pytest.fixture
+def ports(port):
+    return {port: 'virtual'}
+
+
+def jointAngles(port):
+    # the angles row of the 'j' table
+    import ardSerial
+    result = ardSerial.sendTask({port: 'virtual'}, port, ['j', 0])
+    return [int(a) for a in result[1].split('\n')[1].split(',')[:-1]]
@@ -0,0 +1,26 @@
+import pytest
+
+from benchEncoder import legacyEncode, packets
+from packetEncoder import PacketEncoder, encodeBinary
+
+
+@pytest.mark.parametrize('name', sorted(packets))
+def test_same_bytes_as_legacy_encoding(name):
+    token, var = packets[name]
+    assert bytes(PacketEncoder().encode(token, var)) == legacyEncode(token, var)
+    assert bytes(encodeBinary(token, var)) == legacyEncode(token, var)
+
+
+@pytest.mark.parametrize('name', sorted(packets))
+def test_numpy_arrays(name):
+    np = pytest.importorskip('numpy')
+    token, var = packets[name]
+    array = np.array(var, dtype=np.int16 if token == 'K' else np.int8)
+    assert bytes(PacketEncoder().encode(token, array)) == legacyEncode(token, var)
+
+
+def test_encoder_reuses_buffer():
+    encoder = PacketEncoder(size=8)
+    first = bytes(encoder.encode('L', [30] * 16))
+    assert bytes(encoder.encode('I', [8, 30, 9, 30])) == legacyEncode('I', [8, 30, 9, 30])
+    assert first == legacyEncode('L', [30] * 16)
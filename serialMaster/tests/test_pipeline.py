@@ -0,0 +1,51 @@
+import time
+
+import ardSerial
+from conftest import jointAngles
+
+skillA = [1, 0, 0, 1] + [10] * 16
+skillB = [1, 0, 0, 1] + [40] * 16
+
+
+def test_results_in_task_order(port):
+    tasks = [['kbalance', 0], ['j', 0], ['I', [8, 30, 9, 30], 0], ['m', [0, 20], 0], ['d', 0]]
+    results = ardSerial.sendTaskPipeline(port, tasks)
+    assert [r[0].strip() for r in results] == ['k', 'j', 'I', 'm', 'd']
+    assert '\n' in results[1][1]    # the table of 'j' is kept with its echo
+
+
+def test_joint_updates_arrive_in_order(port):
+    tasks = [['I', [0, 30], 0], ['j', 0], ['L', [0] * 8 + [20] * 8, 0], ['j', 0]]
+    results = ardSerial.sendTaskPipeline(port, tasks)
+    assert results[1][1].split('\n')[1].startswith('30,')
+    assert jointAngles(port) == [0] * 8 + [20] * 8
+
+
+def test_behavior_is_not_aborted(port):
+    # any serial input aborts a running behavior, so the next task waits for its echo
+    start = time.time()
+    results = ardSerial.sendTaskPipeline(port, [['kbf', 0], ['ksit', 0]])
+    assert [r[0].strip() for r in results] == ['k', 'k']
+    assert time.time() - start < 5
+
+
+def test_failed_task_stops_the_pipeline(port, ports):
+    results = ardSerial.sendTaskPipeline(port, [['b', [10, 1], 0], ['j', 0]], timeout=0.3)
+    assert results == [-1, None]
+    assert ardSerial.send(ports, ['j', 0])[0].strip() == 'j'    # the port is still usable
+
+
+def test_unsent_skill_is_not_replayed(port, ports):
+    # a K that a failed task kept from being written must be uploaded the next time
+    ardSerial.send(ports, ['K', list(skillA), 0])
+    results = ardSerial.sendTaskPipeline(port, [['b', [10, 1], 0], ['K', list(skillB), 0]], timeout=0.3)
+    assert results == [-1, None]
+    ardSerial.send(ports, ['K', list(skillB), 0])
+    assert jointAngles(port) == [40] * 16
+
+
+def test_pipelined_skill_is_tracked(port, ports):
+    ardSerial.send(ports, ['K', list(skillA), 0])
+    ardSerial.sendTaskPipeline(port, [['K', list(skillB), 0], ['j', 0]])
+    ardSerial.send(ports, ['K', list(skillA), 0])
+    assert jointAngles(port) == [10] * 16
@@ -0,0 +1,53 @@
+import ardSerial
+import serialSession
+from SerialCommunication import Communication
+from serialSession import SessionReplayer, loadSession
+
+tasks = [['?', 0], ['kbalance', 0], ['j', 0], ['I', [8, 30, 9, 30], 0], ['K', [1, 0, 0, 1] + [0] * 8 + [30] * 8, 0], ['d', 0]]
+
+
+def runTasks(port):
+    return [ardSerial.sendTask({port: 'session'}, port, task, 3) for task in tasks]
+
+
+def test_record_and_replay(robot, tmp_path):
+    path = str(tmp_path / 'session.ocs')
+    serialSession.startRecording(path)
+    port = Communication(robot.name, 115200, 1)
+    try:
+        recorded = runTasks(port)
+    finally:
+        port.Close_Engine()
+        serialSession.stopRecording()
+    assert -1 not in recorded
+
+    session = loadSession(path)
+    assert session.ports == [robot.name]
+    summary = session.summary()[robot.name]
+    assert summary['writes'] == len(tasks)
+    assert summary['bytesIn'] == sum(len(r[0]) + len(r[1]) for r in recorded)
+
+    replayer = SessionReplayer(path, speed=0)
+    port = Communication(replayer.start(), 115200, 1)
+    try:
+        replayed = runTasks(port)
+    finally:
+        port.Close_Engine()
+        replayer.stop()
+    assert replayed == recorded
+    assert replayer.mismatches == 0
+
+
+def test_cut_record_is_ignored(robot, tmp_path):
+    path = str(tmp_path / 'session.ocs')
+    serialSession.startRecording(path)
+    port = Communication(robot.name, 115200, 1)
+    try:
+        ardSerial.sendTask({port: 'session'}, port, ['j', 0])
+    finally:
+        port.Close_Engine()
+        serialSession.stopRecording()
+    complete = len(list(loadSession(path).records()))
+    with open(path, 'ab') as f:
+        f.write(serialSession.sessionRecord.pack(1.0, serialSession.READ, 0, 100) + b'cut')    # as after a crash
+    assert len(list(loadSession(path).records())) == complete
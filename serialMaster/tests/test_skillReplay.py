@@ -0,0 +1,52 @@
+import ardSerial
+from SerialCommunication import bootBanner
+from conftest import jointAngles
+
+skillA = [1, 0, 0, 1] + [10] * 16
+skillB = [1, 0, 0, 1] + [40] * 16
+
+
+def recordPackets(port):
+    written = list()
+    send = port.Send_Packet
+
+    def record(data, *args, **kwargs):
+        written.append(bytes(data))
+        return send(data, *args, **kwargs)
+    port.Send_Packet = record
+    return written
+
+
+def test_same_skill_is_replayed(port, ports):
+    written = recordPackets(port)
+    assert ardSerial.send(ports, ['K', list(skillA), 0])[0].startswith('k')
+    assert ardSerial.send(ports, ['K', list(skillA), 0])[0].startswith('k')
+    assert written[1] == ardSerial.replaySkill
+    assert len(written[0]) == len(skillA) + 2
+    assert jointAngles(port) == [10] * 16
+
+
+def test_other_skill_is_uploaded(port, ports):
+    written = recordPackets(port)
+    ardSerial.send(ports, ['K', list(skillA), 0])
+    ardSerial.send(ports, ['K', list(skillB), 0])
+    ardSerial.send(ports, ['K', list(skillA), 0])
+    assert ardSerial.replaySkill not in written
+    assert jointAngles(port) == [10] * 16
+
+
+def test_forgotten_skill_is_uploaded(port, ports):
+    written = recordPackets(port)
+    ardSerial.send(ports, ['K', list(skillA), 0])
+    ardSerial.forgetSkill(port)
+    assert port.lastSkill is None
+    ardSerial.send(ports, ['K', list(skillA), 0])
+    assert written[1] != ardSerial.replaySkill
+
+
+def test_reboot_forgets_skill(port, ports):
+    written = recordPackets(port)
+    ardSerial.send(ports, ['K', list(skillA), 0])
+    port.reader.feed(bootBanner + b'\r\n')    # the board restarted and lost the skill
+    ardSerial.send(ports, ['K', list(skillA), 0])
+    assert written[1] != ardSerial.replaySkill
@@ -0,0 +1,61 @@
+import pytest
+
+import taskQueue
+from conftest import jointAngles
+from SerialCommunication import Communication
+from taskQueue import compileSchedule, queueTask, sendSchedule
+from virtualRobot import VirtualRobot
+
+schedule = [['ksit', 0.3], ['m', [0, 45, 0, -45], 0.2], ['L', [0] * 8 + [30] * 8, 0.1],
+            ['K', [1, 0, 0, 1] + [0] * 16, 0], ['I', [8, 30, 9, 30], 0], ['kbalance', 0], ['d', 0]]
+
+
+def test_compile_schedule():
+    assert compileSchedule(schedule) == [
+        ['q', b'qksit:300>m0 45 0 -45:200\n', [0, 1]],
+        ['q', b'qi0 0 1 0 2 0 3 0 4 0 5 0 6 0 7 0 8 30 9 30 10 30 11 30 12 30 13 30 14 30 15 30:100\n', [2]],
+        ['send', 3],
+        ['q', b'qi8 30 9 30>kbalance>d\n', [4, 5, 6]],
+    ]
+
+
+def test_batch_limits():
+    tasks = [['m', [0, i], 0] for i in range(10)]
+    segments = compileSchedule(tasks, maxTasks=4)
+    assert [len(s[2]) for s in segments] == [4, 4, 2]
+    for s in compileSchedule(tasks, maxBytes=20):
+        assert len(s[1]) <= 20
+
+
+def test_queue_task_conversions():
+    assert queueTask(['m', ['m', '0', '45'], 0]) == 'm 0 45'
+    assert queueTask(['I', ['I8', '30'], 0]) == 'i8 30'
+    assert queueTask(['B', [14, 4], 0]) == 'b14 32'
+
+
+def test_strict_rejects_binary_tokens():
+    with pytest.raises(ValueError):
+        compileSchedule([['K', [1, 0, 0, 1] + [0] * 16, 0]], strict=True)
+    with pytest.raises(ValueError):
+        compileSchedule([['m', [0, 45], 40]], strict=True)    # the delay doesn't fit in the firmware's int
+
+
+def test_send_schedule(robot, port, ports):
+    results = sendSchedule(ports, schedule)
+    assert [r[0].strip() for r in results] == ['k', 'm', 'i', 'k', 'i', 'k', 'd']
+    assert robot.received['q'] == 4    # the support probe and three batches
+    assert robot.received['K'] == 1
+
+
+def test_send_schedule_without_task_queue():
+    robot = VirtualRobot(taskQueue=False)
+    port = Communication(robot.start(), 115200, 1)
+    try:
+        results = sendSchedule({port: 'virtual'}, schedule[:3])
+        assert [r[0].strip() for r in results] == ['k', 'm', 'L']
+        assert robot.received['q'] == 1    # only the probe, the tasks are sent one by one
+        assert jointAngles(port) == [0] * 8 + [30] * 8
+    finally:
+        port.Close_Engine()
+        robot.stop()
+        taskQueue.supportCache.pop(port, None)
@@ -0,0 +1,566 @@
+#!/usr/bin/python3
+# -*- coding: UTF-8 -*-
+
+# A virtual NyBoard / BiBoard on a pseudo-terminal, for developing and benchmarking the host side without a robot.
+# It parses the serial commands like read_serial() in src/io.h, reacts like reaction() in src/reaction.h,
+# and prints the same echoes and tables. The skills are loaded from src/InstinctBittle.h (or InstinctNybble.h).
+# The bytes are received and sent at the wire speed, and the joints move with the timing of transform() in src/motion.h.
+#
+#   python3 virtualRobot.py [--board BiBoard] [--model Nybble] [--latency 0.01] [--jitter 0.005] [--noise 0.05]
+#
+# or in Python:
+#   robot = VirtualRobot(board='NyBoard')
+#   port = robot.start()    # e.g. /dev/pts/3
+#   c = Communication(port, 115200, 1)
+
+import collections
+import os
+import random
+import re
+import select
+import struct
+import threading
+import time
+
+DOF = 16
+boardProfiles = {
+    # buffLen: command buffer of the firmware, stepTime: seconds per step of transform()
+    'NyBoard': {'version': 'N_240907', 'buffLen': 467, 'stepTime': 0.002, 'processTime': 0.002},
+    'BiBoard': {'version': 'B02_240907', 'buffLen': 2507, 'stepTime': 0.001, 'processTime': 0.001},
+}
+serialTimeout = 0.005    # SERIAL_TIMEOUT in src/OpenCat.h, ends a lower case command without '\n'
+serialTimeoutLong = 0.2    # SERIAL_TIMEOUT_LONG, for K and b/B
+gaitFrameTime = 0.02
+gyroPeriod = 0.02    # interval of the verbose gyro prints after 'V'
+srcDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+builtinSkills = {    # used when the instinct header is not found
+    'balance': [1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 30, 30, 30, 30, 30, 30, 30, 30],
+    'calib': [1, 0, 0, 1] + [0] * 16,
+    'rest': [1, 0, 0, 1, -30, -80, -45, 0, -3, -3, 3, 3, 70, 70, 70, 70, -55, -55, -55, -55],
+    'up': [1, 0, 0, 1, 0, 0, 0, 0, 0, 0, 0, 0, 30, 30, 30, 30, 30, 30, 30, 30],
+    'zero': [1, 0, 0, 1] + [0] * 16,
+}
+
+
+def loadInstincts(model='Bittle'):
+    # {name: skill data} parsed from the instinct header of the model
+    path = os.path.join(srcDir, 'InstinctNybble.h' if 'Nybble' in model else 'InstinctBittle.h')
+    try:
+        with open(path) as f:
+            text = f.read()
+    except OSError:
+        return dict(builtinSkills)
+    skills = dict(builtinSkills)
+    for name, body in re.findall(r'const int8_t (\w+)\[\] PROGMEM = \{([^}]*)\}', text):
+        skills[name] = [int(v) for v in re.sub(r'//.*', '', body).replace(',', ' ').split()]
+    return skills
+
+
+def toInt8(data):
+    return list(struct.unpack('{}b'.format(len(data)), data))
+
+
+def asciiNumbers(cmd):
+    # the numbers of an ASCII command, split like strtok(newCmd, " ,\t")
+    numbers = list()
+    for word in re.split(r'[ ,\t]+', cmd.decode('ISO-8859-1').strip()):
+        try:
+            numbers.append(int(word))
+        except ValueError:
+            pass
+    return numbers
+
+
+class Skill(object):
+    def __init__(self, data):
+        self.period = data[0]
+        self.skillHeader = 4 if self.period > 0 else 7
+        if self.period > 1:
+            self.frameSize = 8  # gait
+        elif self.period == 1:
+            self.frameSize = 16  # posture
+        else:
+            self.frameSize = 20  # behavior
+        self.angleRatio = data[3] if data[3] > 1 else 1
+        self.loopCycle = data[4:7] if self.period < 0 else [0, 0, 0]
+        self.frames = [data[self.skillHeader + f * self.frameSize:self.skillHeader + (f + 1) * self.frameSize]
+                       for f in range(abs(self.period))]
+        self.size = len(data)
+
+    def target(self, frame, current):
+        # the 16 joint angles of a frame; a gait only moves the leg joints
+        angles = [a * self.angleRatio for a in self.frames[frame][:min(DOF, self.frameSize)]]
+        if self.frameSize == 8:
+            return list(current[:8]) + angles
+        return angles
+
+
+class VirtualRobot(object):
+    """
+    Emulated OpenCat firmware behind a pseudo-terminal
+    latency, jitter: extra seconds before each reply, noise: probability of a garbage line before a reply
+    taskQueue: False emulates the builds without TASK_QUEUE (e.g. the NyBoard with gyro and IR), where 'q' is an
+    unknown token that is only echoed
+    """
+    def __init__(self, board='NyBoard', model='Bittle', bps=115200, latency=0.0, jitter=0.0, noise=0.0,
+                 boot=False, seed=None, taskQueue=True):
+        profile = boardProfiles[board]
+        self.board = board
+        self.model = model
+        self.version = profile['version']
+        self.buffLen = profile['buffLen']
+        self.stepTime = profile['stepTime']
+        self.processTime = profile['processTime']
+        self.wireRate = bps / 10.0
+        self.latency = latency
+        self.jitter = jitter
+        self.noise = noise
+        self.boot = boot
+        self.taskQueue = taskQueue
+        self.tasks = collections.deque()    # [token, parameters, delay] of the 'q' command
+        self.taskTime = 0.0    # the next task runs after the delay of the previous one
+        self.random = random.Random(seed)
+        self.skills = loadInstincts(model)
+        self.angles = self.skillTarget('rest')
+        self.calib = [0] * DOF
+        self.savedCalib = [0] * DOF
+        self.gyroBalance = True
+        self.fineAdjust = True
+        self.printGyro = False
+        self.randomMind = False
+        self.paused = False
+        self.melody = True
+        self.color = None
+        self.lastToken = ''
+        self.gait = None    # [Skill, start time]
+        self.tempSkill = None    # the last K data, replayed by T
+        self.spaceAfterStoringData = self.buffLen
+        self.received = collections.Counter()    # number of commands per token
+        self.pending = bytearray()
+        self.rxClock = 0.0
+        self.lastArrival = 0.0
+        self.master = None
+        self.slave = None
+        self.name = None
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        """
+        open the pseudo-terminal and return the name of the port to open
+        """
+        import tty
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)    # the slave stays open, so the robot survives the host closing its port
+        self.name = os.ttyname(self.slave)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self.name
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join(1)
+        for fd in (self.master, self.slave):
+            if fd is not None:
+                os.close(fd)
+        self.master = self.slave = None
+
+    # serial port
+
+    def run(self):
+        if self.boot:
+            self.println('k')
+            self.println('\n* Start *')
+            self.println(self.model)
+            self.println(self.version)
+            self.println('Ready!')
+        lastGyro = time.time()
+        while self.running:
+            wait = 0.1
+            if self.pending:
+                wait = min(wait, max(0, self.lastArrival + self.commandTimeout() - time.time()))
+            if self.printGyro:
+                wait = min(wait, max(0, lastGyro + gyroPeriod - time.time()))
+            try:
+                if select.select([self.master], [], [], wait)[0]:
+                    self.receive(os.read(self.master, 4096))
+            except (OSError, ValueError):
+                break
+            self.runTasks()
+            command = self.nextCommand()
+            while command is not None:
+                self.handle(*command)
+                self.runTasks()
+                command = self.nextCommand()
+            if self.printGyro and time.time() - lastGyro >= gyroPeriod:
+                self.println(self.gyroLine())
+                lastGyro = time.time()
+
+    def runTasks(self):
+        # the firmware doesn't read the serial port until the queue is empty and the last delay has passed
+        while self.tasks:
+            token, cmd, delay = self.tasks.popleft()
+            wait = self.taskTime - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self.handle(token, cmd)
+            self.taskTime = time.time() + delay
+        wait = self.taskTime - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+    def receive(self, data):
+        # the bytes arrive at the wire speed
+        now = time.time()
+        self.rxClock = max(now, self.rxClock) + len(data) / self.wireRate
+        if self.rxClock > now:
+            time.sleep(self.rxClock - now)
+        self.pending += data
+        self.lastArrival = time.time()
+
+    def inputWaiting(self):
+        return self.pending or select.select([self.master], [], [], 0)[0]
+
+    def commandTimeout(self):
+        token = chr(self.pending[0])
+        return serialTimeoutLong if token == 'K' or token.lower() == 'b' else serialTimeout
+
+    def nextCommand(self):
+        if not self.pending:
+            return None
+        token = chr(self.pending[0])
+        terminator = b'~' if 'A' <= token <= 'Z' else b'\n'
+        end = self.pending.find(terminator, 1)
+        limit = self.spaceAfterStoringData if token in 'kim' else self.buffLen
+        if (end if end >= 0 else len(self.pending)) - 1 >= limit:
+            self.overflow(token)
+            return None
+        if end < 0:
+            if time.time() - self.lastArrival < self.commandTimeout():
+                return None
+            if token == 'K':
+                self.abortUpload()
+                return None
+            end = len(self.pending)
+        cmd = bytes(self.pending[1:end])
+        del self.pending[:end + 1]
+        if terminator == b'\n':
+            cmd = cmd.rstrip(b'\r')
+        return token, cmd
+
+    def overflow(self, token):
+        self.println('OVF')
+        time.sleep(0.5)
+        self.pending.clear()
+        while select.select([self.master], [], [], 0)[0]:
+            os.read(self.master, 4096)
+        self.println(token)
+        self.loadSkill('up')
+        self.lastToken = 'k'
+
+    def abortUpload(self):
+        # a K without its terminator is dropped like in read_serial()
+        self.println('ABT')
+        self.pending.clear()
+        self.println('K')
+        self.loadSkill('up')
+        self.lastToken = 'k'
+        self.println('k')
+
+    def write(self, data):
+        if self.noise and self.random.random() < self.noise:
+            junk = bytes(self.random.choice(b'#$%&*+<>@^|\x80\x9f\xa5\xfe') for i in range(self.random.randint(3, 12)))
+            data = junk + b'\r\n' + data
+        time.sleep(len(data) / self.wireRate)
+        os.write(self.master, data)
+
+    def println(self, value=''):
+        self.write((str(value) + '\r\n').encode('ISO-8859-1'))
+
+    def printTable(self, values):
+        self.println(''.join('{}\t'.format(i) for i in range(DOF)))
+        self.println(''.join('{},\t'.format(v) for v in values))
+
+    def gyroLine(self):
+        return '{:.5f}\t{:.5f}\t{}\t{}\t{}'.format(self.random.gauss(0, 0.5), self.random.gauss(0, 0.5),
+                                                 self.random.randint(-20, 20), self.random.randint(-20, 20),
+                                                 8192 + self.random.randint(-40, 40))
+
+    # motion
+
+    def skillTarget(self, name):
+        skill = Skill(self.skills.get(name, builtinSkills['rest']))
+        return skill.target(skill.period - 1 if skill.period > 0 else abs(skill.period) - 1, [0] * DOF)
+
+    def currentAngles(self):
+        if self.gait is not None and not self.paused:
+            skill, start = self.gait
+            frame = int((time.time() - start) / gaitFrameTime) % skill.period
+            return skill.target(frame, self.angles)
+        return list(self.angles)
+
+    def transform(self, target, speedRatio=2):
+        # same number of steps as transform() in src/motion.h
+        current = self.currentAngles()
+        self.gait = None
+        maxDiff = max(abs(c - t) for c, t in zip(current, target))
+        steps = int(round(maxDiff / speedRatio)) if speedRatio > 0 else 0
+        time.sleep((steps + 1) * self.stepTime)
+        self.angles = list(target)
+
+    def loadSkill(self, name):
+        if name not in self.skills:
+            return True
+        return self.runSkill(Skill(self.skills[name]))
+
+    def runSkill(self, skill):
+        # returns False if a behavior is interrupted by new serial input
+        if skill.period > 1:
+            self.transform(skill.target(0, self.currentAngles()), 1)
+            self.gait = [skill, time.time()]
+        elif skill.period == 1:
+            self.transform(skill.target(0, self.angles), 1)
+        else:
+            repeat = 0 if 0 <= skill.loopCycle[2] < 2 else skill.loopCycle[2] - 1
+            c = 0
+            while c < abs(skill.period):
+                if self.inputWaiting():
+                    self.runSkill(Skill(self.skills.get('up', builtinSkills['up'])))
+                    return False
+                frame = skill.frames[c]
+                self.transform(skill.target(c, self.angles), frame[DOF] / 4.0)
+                time.sleep(abs(frame[DOF + 1]) * 0.05)
+                if repeat != 0 and c != 0 and c == skill.loopCycle[1]:
+                    c = skill.loopCycle[0] - 1
+                    if repeat > 0:
+                        repeat -= 1
+                c += 1
+        return True
+
+    def setJoints(self, pairs, sequential=False):
+        if len(pairs) < 2:
+            return
+        target = self.currentAngles()
+        for i in range(0, len(pairs) - 1, 2):
+            if 0 <= pairs[i] < DOF:
+                target[pairs[i]] = pairs[i + 1]
+                if sequential:
+                    self.transform(target)
+        self.transform(target)
+
+    # commands
+
+    def handle(self, token, cmd):
+        self.received[token] += 1
+        time.sleep(self.processTime + self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0))
+        if self.lastToken in ('c', 'd') and token != 'c':
+            self.gyroBalance = True
+            self.println('G')
+        if token != 'p' and self.paused:
+            self.paused = False
+            self.println('p')
+        handler = self.handlers().get(token)
+        echo = handler(cmd) if handler is not None else token
+        if echo is not None:
+            self.println(echo)
+            self.lastToken = 'k' if echo in ('k', 'T') else token
+        else:
+            self.lastToken = 'k'
+
+    def handlers(self):
+        return {
+            '?': self.query, 'g': self.gyroFineness, 'G': self.gyroBalanceToggle, 'v': self.printGyroOnce,
+            'V': self.printGyroToggle, 'z': self.randomMindToggle, 'p': self.pause, 'j': self.joints,
+            'c': self.calibrate, 'm': self.indexedSequential, 'i': self.indexedSimultaneous, 'b': self.beep,
+            's': self.save, 'a': self.abort, 'I': self.indexedSimultaneousBinary, 'M': self.indexedSequentialBinary,
+            'L': self.listed, 'B': self.beepBinary,
+            'C': self.setColor, 'R': self.readPin, 'W': self.writePin, 'K': self.skillData, 'T': self.temp,
+            'k': self.skill, 'd': self.rest, 'q': self.queueTasks,
+        }
+
+    def query(self, cmd):
+        self.println(self.model)
+        self.println(self.version)
+        return '?'
+
+    def gyroFineness(self, cmd):
+        self.fineAdjust = not self.fineAdjust
+        return 'G' if self.fineAdjust else 'g'
+
+    def gyroBalanceToggle(self, cmd):
+        self.gyroBalance = not self.gyroBalance
+        return 'G' if self.gyroBalance else 'g'
+
+    def printGyroOnce(self, cmd):
+        self.println(self.gyroLine())
+        return 'v'
+
+    def printGyroToggle(self, cmd):
+        self.printGyro = not self.printGyro
+        return 'V' if self.printGyro else 'v'
+
+    def randomMindToggle(self, cmd):
+        self.randomMind = not self.randomMind
+        return 'Z' if self.randomMind else 'z'
+
+    def pause(self, cmd):
+        self.paused = not self.paused
+        if self.paused:
+            if self.gait is not None:
+                self.angles = self.currentAngles()
+            return 'P'
+        if self.gait is not None:
+            self.gait[1] = time.time()
+        return 'k'
+
+    def joints(self, cmd):
+        angles = self.currentAngles()
+        numbers = asciiNumbers(cmd)
+        if numbers and 0 <= numbers[0] < DOF:
+            self.println('=' + str(angles[numbers[0]]))
+        else:
+            self.write(b'=')
+            self.printTable(angles)
+        return 'j'
+
+    def calibrate(self, cmd):
+        numbers = asciiNumbers(cmd)
+        if self.lastToken != 'c':
+            self.gyroBalance = False
+            self.transform(self.skillTarget('calib'))
+        pairs = [numbers[i:i + 2] for i in range(0, len(numbers), 2)] or [[]]
+        for pair in pairs:
+            if len(pair) == 2 and 0 <= pair[0] < DOF:
+                self.calib[pair[0]] = pair[1]
+            self.printTable(self.calib)
+        return 'c'
+
+    def indexedSimultaneous(self, cmd):
+        self.setJoints(asciiNumbers(cmd))
+        return 'i'
+
+    def indexedSequential(self, cmd):
+        self.setJoints(asciiNumbers(cmd), sequential=True)
+        return 'm'
+
+    def indexedSimultaneousBinary(self, cmd):
+        self.setJoints(toInt8(cmd))
+        return 'I'
+
+    def indexedSequentialBinary(self, cmd):
+        self.setJoints(toInt8(cmd), sequential=True)
+        return 'M'
+
+    def listed(self, cmd):
+        angles = toInt8(cmd)[:DOF]
+        if len(angles) == DOF:
+            self.transform(angles, 2)
+        return 'L'
+
+    def beep(self, cmd):
+        numbers = asciiNumbers(cmd)
+        if not numbers:
+            self.melody = not self.melody
+        for i in range(1, len(numbers), 2):
+            if numbers[i]:
+                time.sleep(1.0 / numbers[i])
+        return 'b'
+
+    def beepBinary(self, cmd):
+        numbers = toInt8(cmd)
+        for i in range(1, len(numbers), 2):
+            if numbers[i]:
+                time.sleep(1.0 / numbers[i])
+        return 'B'
+
+    def save(self, cmd):
+        self.println('saved')
+        self.savedCalib = list(self.calib)
+        return 's'
+
+    def abort(self, cmd):
+        self.println('aborted')
+        self.calib = list(self.savedCalib)
+        return 'a'
+
+    def setColor(self, cmd):
+        self.color = list(cmd) if len(cmd) >= 2 else None
+        return 'C'
+
+    def readPin(self, cmd):
+        for i in range(0, len(cmd) - 1, 2):
+            self.write(b'=')
+            self.println(self.random.randint(0, 1023) if cmd[i] == ord('a') else self.random.randint(0, 1))
+        return 'R'
+
+    def writePin(self, cmd):
+        return 'W'
+
+    def skillData(self, cmd):
+        data = toInt8(cmd)
+        try:
+            skill = Skill(data)
+        except IndexError:
+            return 'k'
+        self.tempSkill = data
+        self.spaceAfterStoringData = self.buffLen - (skill.size - skill.skillHeader) - 1
+        return 'k' if self.runSkill(skill) else None
+
+    def temp(self, cmd):
+        self.println('T')
+        if self.tempSkill is None:
+            return 'k'
+        return 'k' if self.runSkill(Skill(self.tempSkill)) else None
+
+    def skill(self, cmd):
+        name = cmd.decode('ISO-8859-1').strip()
+        if name == 'x':
+            name = self.random.choice(list(self.skills))
+        return 'k' if self.loadSkill(name) else None
+
+    def queueTasks(self, cmd):
+        # createTask() in src/taskQueue.h: "token parameters:delay>..."
+        if not self.taskQueue:
+            return 'q'
+        for task in cmd.split(b'>'):
+            if not task:
+                continue
+            delay = 0
+            if b':' in task:
+                task, delayText = task.rsplit(b':', 1)
+                delay = int(re.match(rb'-?\d*', delayText.strip()).group() or 0)
+            token = chr(task[0]) if task else ''
+            if 'a' <= token <= 'z' or token == '?':
+                self.tasks.append([token, task[1:], delay / 1000.0])
+        self.taskTime = time.time()
+        return 'q'
+
+    def rest(self, cmd):
+        self.loadSkill('rest')
+        self.gyroBalance = False
+        self.println('g')
+        return 'd'
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Virtual OpenCat robot on a pseudo-terminal')
+    parser.add_argument('--board', default='NyBoard', choices=list(boardProfiles))
+    parser.add_argument('--model', default='Bittle')
+    parser.add_argument('--latency', type=float, default=0.0, help='extra seconds before each reply')
+    parser.add_argument('--jitter', type=float, default=0.0, help='random extra seconds before each reply')
+    parser.add_argument('--noise', type=float, default=0.0, help='probability of a garbage line before a reply')
+    parser.add_argument('--boot', action='store_true', help='print the boot messages')
+    parser.add_argument('--noTaskQueue', action='store_true', help='emulate a build without the task queue')
+    args = parser.parse_args()
+    robot = VirtualRobot(args.board, args.model, latency=args.latency, jitter=args.jitter, noise=args.noise, boot=args.boot,
+                         taskQueue=not args.noTaskQueue)
+    print('Virtual {} {} on {}'.format(args.model, args.board, robot.start()), flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        robot.stop()
@@ -438,6 +438,7 @@ float protectiveShift;  //reduce the wearing of the potentiometer
 #include "imu.h"
 #ifdef IR_PIN
 #undef TASK_QUEUE
+#undef T_TASK_QUEUE  //'q' is only echoed, there is no tQueue
 #endif
 #endif
 
@@ -48,6 +48,13 @@ void read_serial() {
                                                                   //if the terminator of the command is set to "no line ending" or "new line", parsing can be different
                                                                   //so it needs a timeout for the no line ending case
     // PTH("*SR\t", long(millis() - lastSerialTime));
+    if (token == T_SKILL_DATA && newCmd[cmdLen - 1] != terminator) {  //the host stopped the upload, don't run a partial skill
+      PTLF("ABT");
+      PTL(token);
+      token = T_SKILL;
+      strcpy(newCmd, "up");
+      return;
+    }
     cmdLen = (newCmd[cmdLen - 1] == terminator) ? cmdLen - 1 : cmdLen;
     newCmd[cmdLen] = (token >= 'A' && token <= 'Z') ? '~' : '\0';
     // PTL(cmdLen);
@@ -488,11 +488,13 @@ void reaction() {
           break;
         }
 
-        // case T_TASK_QUEUE:
-        //   {
-        //     tQueue->createTask();
-        //     break;
-        //   }
+#ifdef T_TASK_QUEUE
+      case T_TASK_QUEUE:
+        {  //the tasks are executed one by one after this command, and each of them echoes its token
+          tQueue->createTask(newCmd);
+          break;
+        }
+#endif
 
 #endif
       case T_REST:
@@ -30,9 +30,21 @@ public:
   TaskQueue() {
     PTLF("TaskQ");
   };
-  void createTask() {  //this is an example task
-    this->addTask('k', "vtF", 2000);
-    this->addTask('k', "up");
+  void createTask(char *tasks) {  //parse a task string, e.g. "ksit:1000>m0 45 0 -45:500>kbalance" of the command "qksit:1000>..."
+                                 //each task is a token with its ASCII parameters and an optional delay in ms, separated by '>'
+                                 //the string is modified
+    char *task = strtok(tasks, ">");
+    while (task != NULL) {
+      int dly = 0;
+      char *delayText = strrchr(task, ':');
+      if (delayText != NULL) {
+        *delayText = '\0';
+        dly = atoi(delayText + 1);
+      }
+      if ((task[0] >= 'a' && task[0] <= 'z') || task[0] == T_QUERY)  //the binary commands cannot be embedded in the ASCII command
+        this->addTask(task[0], task + 1, dly);
+      task = strtok(NULL, ">");
+    }
   }
   template<typename T> void addTask(char t, T* p, int d = 0) {
     this->push_back(new Task(t, p, d));